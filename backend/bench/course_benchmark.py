@@ -0,0 +1,188 @@
+"""
+End-to-end benchmark for /courses/create. Uploads a zip of generated PDFs to
+a running backend and reports time to the first progress event, total
+generation time, LLM calls per course (from the stub's /stats) and DB rows
+written per course (row count deltas in the sqlite file).
+
+Run the backend against bench/stub_llm.py, from the backend directory:
+
+    python bench/stub_llm.py &
+    GROK_API_URL=http://localhost:8100/openai/v1/chat/completions uvicorn main:app --port 8000 &
+    python bench/course_benchmark.py --sections 4 --pages-per-pdf 5 --runs 3
+"""
+import argparse
+import asyncio
+import io
+import json
+import sqlite3
+import statistics
+import time
+import uuid
+import zipfile
+
+import aiohttp
+
+WORDS = "the derivative measures how a function changes as its input changes and the integral accumulates those changes over an interval".split()
+
+def make_pdf(pages: list[list[str]]) -> bytes:
+    """
+    Minimal PDF with one Helvetica text line per entry, enough for PyPDF2 to
+    extract the text back.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for lines in pages:
+        stream = "BT /F1 10 Tf 50 750 Td 12 TL\n"
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            stream += f"({escaped}) Tj T*\n"
+        stream += "ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode())
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>".encode()
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+def make_course_zip(sections: int, pages_per_pdf: int, lines_per_page: int = 50) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for section in range(sections):
+            pages = [
+                [
+                    f"Section {section + 1} page {page + 1}: " + " ".join(WORDS[(line + page) % len(WORDS):] + WORDS)[:90]
+                    for line in range(lines_per_page)
+                ]
+                for page in range(pages_per_pdf)
+            ]
+            archive.writestr(f"section_{section + 1:02d}.pdf", make_pdf(pages))
+    return buffer.getvalue()
+
+def table_counts(db_path: str) -> dict:
+    with sqlite3.connect(db_path) as conn:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+
+async def login(session, api: str) -> str:
+    email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+    password = uuid.uuid4().hex
+    async with session.post(f"{api}/register", json={
+        "email": email, "password": password, "username": email.split("@")[0], "role": "professor"
+    }) as response:
+        response.raise_for_status()
+    async with session.post(f"{api}/token", data={"username": email, "password": password}) as response:
+        response.raise_for_status()
+        return (await response.json())["access_token"]
+
+async def run_once(session, args, token: str, archive: bytes) -> dict:
+    if args.stub:
+        async with session.post(f"{args.stub}/stats/reset") as response:
+            response.raise_for_status()
+    rows_before = table_counts(args.db)
+
+    form = aiohttp.FormData()
+    form.add_field("title", "Benchmark Course")
+    form.add_field("description", "Generated by the course benchmark")
+    form.add_field("regenerate", "false" if args.cached else "true")
+    form.add_field("content", archive, filename="course.zip", content_type="application/zip")
+
+    started = time.perf_counter()
+    first_event = None
+    events = 0
+    error = None
+    async with session.post(
+        f"{args.api}/courses/create", data=form, headers={"Authorization": f"Bearer {token}"}
+    ) as response:
+        response.raise_for_status()
+        # sse lines can be split across reads, so read line by line
+        async for line in response.content:
+            line = line.decode().strip()
+            if not line.startswith("data:"):
+                continue
+            if first_event is None:
+                first_event = time.perf_counter() - started
+            events += 1
+            data = json.loads(line[len("data:"):])
+            if data.get("type") == "error":
+                error = data.get("message")
+            if error or (data.get("type") == "quiz" and data.get("status") == "completed"):
+                break
+    total = time.perf_counter() - started
+
+    rows_after = table_counts(args.db)
+    rows = {table: rows_after.get(table, 0) - rows_before.get(table, 0) for table in rows_after}
+    result = {
+        "time_to_first_event": round(first_event or total, 3),
+        "total_time": round(total, 3),
+        "events": events,
+        "db_rows_written": sum(rows.values()),
+        "db_rows_by_table": {table: count for table, count in rows.items() if count},
+        "error": error,
+    }
+    if args.stub:
+        async with session.get(f"{args.stub}/stats") as response:
+            stub_stats = await response.json()
+        result["llm_calls"] = stub_stats["calls"]
+        result["llm"] = stub_stats
+    return result
+
+async def benchmark(args):
+    archive = make_course_zip(args.sections, args.pages_per_pdf)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=args.timeout)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        token = await login(session, args.api)
+        runs = []
+        for run in range(args.runs):
+            result = await run_once(session, args, token, archive)
+            runs.append(result)
+            print(f"run {run + 1}: {json.dumps(result)}")
+
+    summary = {
+        "sections": args.sections,
+        "pages_per_pdf": args.pages_per_pdf,
+        "upload_bytes": len(archive),
+        "runs": len(runs),
+    }
+    for key in ("time_to_first_event", "total_time", "llm_calls", "db_rows_written"):
+        values = [run[key] for run in runs if key in run]
+        if values:
+            summary[key] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "runs": runs}, f, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark course generation end to end")
+    parser.add_argument("--api", default="http://localhost:8000", help="backend URL")
+    parser.add_argument("--stub", default="http://localhost:8100", help="stub LLM URL, empty to skip LLM stats")
+    parser.add_argument("--db", default="./sql_app.db", help="the backend's sqlite file")
+    parser.add_argument("--sections", type=int, default=4, help="PDFs in the uploaded zip")
+    parser.add_argument("--pages-per-pdf", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--cached", action="store_true", help="allow LLM response cache hits")
+    parser.add_argument("--timeout", type=float, default=600, help="max seconds between events")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    asyncio.run(benchmark(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Local stand-in for the Groq chat completions API, for benchmarking without
+calling (or paying for) the real thing. Start it and point the backend at it:
+
+    python bench/stub_llm.py --port 8100 --latency 0.5 --tokens-per-second 200
+    GROK_API_URL=http://localhost:8100/openai/v1/chat/completions uvicorn main:app
+
+Replies are canned but shaped like what the prompts ask for (a quiz JSON
+array, a course details JSON object or markdown notes) so the whole pipeline
+runs. GET /stats reports the calls it served, POST /stats/reset clears them.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+QUIZ = [
+    {
+        "question": f"Which statement about concept {i + 1} is correct?",
+        "options": ["The first one", "The second one", "The third one", "The fourth one"],
+        "correctAnswer": i % 4
+    }
+    for i in range(4)
+]
+
+COURSE_DETAILS = {
+    "description": "# Benchmark Course\n\nAn introduction.\n\nThe main topics.\n\nWhat you will learn.",
+    "difficulty": "Intermediate",
+    "estimated_hours": 20,
+    "learning_outcomes": ["Outcome 1", "Outcome 2", "Outcome 3", "Outcome 4"],
+    "prerequisites": ["Prerequisite 1", "Prerequisite 2"],
+    "skills_gained": ["Skill 1", "Skill 2", "Skill 3", "Skill 4"],
+    "course_highlights": ["Topic 1", "Topic 2", "Topic 3", "Topic 4"]
+}
+
+class Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.calls = 0
+        self.by_status = {}
+        self.streamed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "by_status": self.by_status,
+            "streamed": self.streamed,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "max_in_flight": self.max_in_flight,
+            "seconds": round(time.time() - self.started, 2),
+        }
+
+def count_tokens(text):
+    # same rough estimate the backend budgets with
+    return len(text) // 4 + 1
+
+def reply_for(messages, max_tokens):
+    prompt = "\n".join(m.get("content", "") for m in messages)
+    if "quiz" in prompt.lower() and "correctAnswer" in prompt:
+        return json.dumps(QUIZ)
+    if "Return a JSON object exactly in this format" in prompt:
+        return json.dumps(COURSE_DETAILS)
+    # markdown notes, about max_tokens long but capped so benchmarks stay quick
+    words = min(max_tokens, 600) * 3 // 4
+    body = " ".join(random.choice(["matrix", "vector", "proof", "limit", "series", "function"]) for _ in range(words))
+    return f"# 📚 Generated Notes\n\n> 💡 **Key Insight:** {body}"
+
+def create_app(args):
+    stats = Stats()
+
+    async def chat_completions(request):
+        stats.calls += 1
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            return await respond(request)
+        finally:
+            stats.in_flight -= 1
+
+    def record(status):
+        stats.by_status[str(status)] = stats.by_status.get(str(status), 0) + 1
+
+    async def respond(request):
+        payload = await request.json()
+        messages = payload.get("messages", [])
+        headers = {
+            "x-ratelimit-remaining-requests": str(args.remaining_requests),
+            "x-ratelimit-remaining-tokens": str(args.remaining_tokens),
+        }
+
+        if random.random() < args.rate_limit_rate:
+            record(429)
+            headers["retry-after"] = str(args.retry_after)
+            return web.json_response({"error": {"message": "Rate limit reached"}}, status=429, headers=headers)
+        if random.random() < args.error_rate:
+            record(500)
+            return web.json_response({"error": {"message": "Injected server error"}}, status=500, headers=headers)
+
+        await asyncio.sleep(args.latency)
+        content = reply_for(messages, payload.get("max_tokens", 1024))
+        prompt_tokens = sum(count_tokens(m.get("content", "")) for m in messages)
+        completion_tokens = count_tokens(content)
+        stats.prompt_tokens += prompt_tokens
+        stats.completion_tokens += completion_tokens
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        record(200)
+
+        if not payload.get("stream"):
+            await asyncio.sleep(completion_tokens / args.tokens_per_second)
+            return web.json_response({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage
+            }, headers=headers)
+
+        stats.streamed += 1
+        response = web.StreamResponse(headers={**headers, "Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        # roughly one token per chunk, paced at tokens_per_second
+        pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+        for piece in pieces:
+            chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(1 / args.tokens_per_second)
+        final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}}
+        await response.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+        await response.write_eof()
+        return response
+
+    async def get_stats(request):
+        return web.json_response(stats.as_dict())
+
+    async def reset_stats(request):
+        stats.reset()
+        return web.json_response(stats.as_dict())
+
+    app = web.Application()
+    app.router.add_post("/openai/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_post("/stats/reset", reset_stats)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Groq chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="completion speed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--remaining-requests", type=int, default=1000)
+    parser.add_argument("--remaining-tokens", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    web.run_app(create_app(args), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -7,4 +7,33 @@ class Config:
     MODEL_NAME: str = "meta-llama/Llama-3.2-3B-Instruct"
     DEFAULT_MAX_TOKENS: int = 100
     DEFAULT_TEMPERATURE: float = 0.5
-    HUGGINGFACE_ACCESS_TOKEN: str = os.getenv("HUGGINGFACE_ACCESS_TOKEN", "")
\ No newline at end of file
+    HUGGINGFACE_ACCESS_TOKEN: str = os.getenv("HUGGINGFACE_ACCESS_TOKEN", "")
+    # load the base model when the server starts instead of on the first request
+    PRELOAD_MODEL: bool = os.getenv("PRELOAD_MODEL", "true").lower() == "true"
+    # how many per-user LoRA adapters stay attached to the shared base model
+    ADAPTER_CACHE_SIZE: int = int(os.getenv("ADAPTER_CACHE_SIZE", "32"))
+    # prefill micro-batches of the scheduler: max prompts per batch and max padded prompt tokens per batch
+    GENERATION_BATCH_SIZE: int = int(os.getenv("GENERATION_BATCH_SIZE", "8"))
+    GENERATION_BATCH_TOKENS: int = int(os.getenv("GENERATION_BATCH_TOKENS", "16384"))
+    # inference worker processes, job queue bound and per-job timeouts in seconds
+    INFERENCE_WORKERS: int = int(os.getenv("INFERENCE_WORKERS", "1"))
+    INFERENCE_QUEUE_SIZE: int = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+    INFERENCE_TIMEOUT: float = float(os.getenv("INFERENCE_TIMEOUT", "300"))
+    FINE_TUNE_TIMEOUT: float = float(os.getenv("FINE_TUNE_TIMEOUT", "3600"))
+    # max sequences decoded together by the continuous batching scheduler, and jobs a worker takes on at once
+    SCHEDULER_MAX_BATCH: int = int(os.getenv("SCHEDULER_MAX_BATCH", "16"))
+    # shared base-model notes: pages per job and jobs in flight per course
+    NOTE_JOB_PAGES: int = int(os.getenv("NOTE_JOB_PAGES", "4"))
+    NOTE_JOBS_IN_FLIGHT: int = int(os.getenv("NOTE_JOBS_IN_FLIGHT", "4"))
+    # liked-feedback fine tuning: quiet period before a student's training starts and trainings run at once
+    TRAINING_DEBOUNCE_SECONDS: float = float(os.getenv("TRAINING_DEBOUNCE_SECONDS", "60"))
+    MAX_CONCURRENT_TRAININGS: int = int(os.getenv("MAX_CONCURRENT_TRAININGS", "1"))
+    # published LoRA adapter versions kept per student
+    LORA_KEEP_VERSIONS: int = int(os.getenv("LORA_KEEP_VERSIONS", "3"))
+    # tokenized LoRA training datasets, keyed by data hash, least recently used ones go past the size limit
+    TOKENIZED_CACHE_DIR: str = os.getenv("TOKENIZED_CACHE_DIR", "./cache/tokenized")
+    TOKENIZED_CACHE_MAX_BYTES: int = int(os.getenv("TOKENIZED_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+    # LLM calls in flight at once while generating one course
+    COURSE_GENERATION_CONCURRENCY: int = int(os.getenv("COURSE_GENERATION_CONCURRENCY", "6"))
+    # extracted PDFs allowed to wait for generation before extraction pauses
+    PIPELINE_QUEUE_SIZE: int = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
@@ -3,11 +3,15 @@ import torch
 from config import Config
 from typing import AsyncGenerator
 from huggingface_hub import login
-from lora import fine_tune_and_save_lora_weights, apply_lora_weights_to_model
+from lora import fine_tune_and_save_lora_weights, apply_lora_weights_to_model, user_lora_weights_dir
 
 def load_base_model():
     # Load tokenizer
     tokenizer = AutoTokenizer.from_pretrained(Config.MODEL_NAME, token=Config.HUGGINGFACE_ACCESS_TOKEN)
+    # decoder-only models need left padding so batched prompts end right before generation
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
         
     # Load model in 8-bit to reduce memory usage
     base_model = AutoModelForCausalLM.from_pretrained(Config.MODEL_NAME, token=Config.HUGGINGFACE_ACCESS_TOKEN)
@@ -16,7 +20,7 @@ def load_base_model():
 
 def load_user_model(user_id):
     model_name = Config.MODEL_NAME
-    lora_weights_dir = f"./user_{user_id}/lora_weights"
+    lora_weights_dir = user_lora_weights_dir(user_id)
 
     model, tokenizer = apply_lora_weights_to_model(
         base_model_name=model_name,
@@ -27,7 +31,7 @@ def load_user_model(user_id):
 def fine_tune_model(user_id, data):
     # data should be an array if dict with input, output, feedback
     model_name = Config.MODEL_NAME
-    lora_weights_dir = f"./user_{user_id}/lora_weights"
+    lora_weights_dir = user_lora_weights_dir(user_id)
 
     fine_tune_and_save_lora_weights(
         model_name=model_name,
@@ -39,8 +43,14 @@ def fine_tune_model(user_id, data):
 def get_device():
     return "cuda" if torch.cuda.is_available() else "cpu"
 
+def initial_note_prompt(page_content):
+    return f"Generate notes for the given content: {page_content}"
+
+def note_prompt(page_content, note_content):
+    return f"I did not like this note: {note_content}. Generate new notes for the given content: {page_content}"
+
 def generate_initial_note(page_content, model, tokenizer):
-    inputs = tokenizer(f"Generate notes for the given content: {page_content}", return_tensors="pt")
+    inputs = tokenizer(initial_note_prompt(page_content), return_tensors="pt")
     outputs = model.generate(**inputs)
     final_output = ""
     for output in outputs:
@@ -48,7 +58,7 @@ def generate_initial_note(page_content, model, tokenizer):
     return final_output
 
 def generate_note(page_content, note_content, model, tokenizer):
-    inputs = tokenizer(f"I did not like this note: {note_content}. Generate new notes for the given content: {page_content}", return_tensors="pt")
+    inputs = tokenizer(note_prompt(page_content, note_content), return_tensors="pt")
     outputs = model.generate(**inputs)
     final_output = ""
     for output in outputs:
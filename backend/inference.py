@@ -0,0 +1,278 @@
+import asyncio
+import itertools
+import multiprocessing as mp
+import queue
+import threading
+import time
+
+from config import Config
+from utils.telemetry import record_llm_call
+
+class InferenceQueueFull(Exception):
+    pass
+
+class InferenceError(Exception):
+    pass
+
+# jobs run inside the worker processes, the model imports are done there so
+# the server process never loads torch
+
+# generation jobs go through the continuous batching scheduler, they map
+# their arguments to (user_id, prompts) and their outputs to the job result
+def _initial_notes_prompts(user_id, page_contents):
+    from generate_answer import initial_note_prompt
+    return user_id, [initial_note_prompt(page_content) for page_content in page_contents]
+
+def _note_prompts(user_id, page_content, note_content):
+    from generate_answer import note_prompt
+    return user_id, [note_prompt(page_content, note_content)]
+
+GENERATION_JOBS = {
+    "initial_notes": (_initial_notes_prompts, lambda outputs: outputs),
+    "note": (_note_prompts, lambda outputs: outputs[0]),
+}
+
+_scheduler = None
+
+def _fine_tune(user_id, data):
+    from generate_answer import fine_tune_model
+    fine_tune_model(user_id, data)
+
+def _status():
+    from model_registry import registry
+    return {**registry.status(), "scheduler": _scheduler.status()}
+
+JOBS = {
+    "fine_tune": _fine_tune,
+    "status": _status,
+}
+
+def _run_job(results, job_id, kind, args, slots):
+    try:
+        results.put((job_id, True, JOBS[kind](*args)))
+    except Exception as e:
+        results.put((job_id, False, f"{type(e).__name__}: {e}"))
+    finally:
+        slots.release()
+
+def _worker_main(jobs, results, preload):
+    global _scheduler
+    from concurrent.futures import ThreadPoolExecutor
+    from model_registry import registry
+    from scheduler import ContinuousBatchScheduler
+    if preload:
+        try:
+            registry.load()
+        except Exception as e:
+            # keep serving, jobs will retry the load and report the error
+            print(f"Inference worker failed to preload model: {e}")
+
+    _scheduler = ContinuousBatchScheduler(registry)
+    # training and status run beside the scheduler so they never stall decoding
+    background = ThreadPoolExecutor(max_workers=2)
+    # a job is only taken off the shared queue while the worker has room for
+    # it, otherwise it waits there and a full queue is InferenceQueueFull
+    slots = threading.Semaphore(Config.SCHEDULER_MAX_BATCH)
+
+    while True:
+        slots.acquire()
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, kind, args, deadline, stream, enqueued_at = job
+        if deadline is not None and time.time() > deadline:
+            # the caller already gave up on this one
+            results.put((job_id, False, "Job expired before it was started"))
+            slots.release()
+            continue
+
+        if kind in GENERATION_JOBS:
+            to_prompts, to_result = GENERATION_JOBS[kind]
+            def reply(outputs, error, metrics, job_id=job_id, to_result=to_result):
+                # called once per job, with its outputs or its error
+                slots.release()
+                if error is None:
+                    results.put((job_id, True, to_result(outputs), metrics))
+                else:
+                    results.put((job_id, False, error, metrics))
+            on_token = None
+            if stream:
+                # partial results are sent with ok=None
+                on_token = lambda index, text, job_id=job_id: results.put((job_id, None, text))
+            try:
+                user_id, prompts = to_prompts(*args)
+            except Exception as e:
+                reply(None, f"{type(e).__name__}: {e}", {})
+                continue
+            _scheduler.submit(user_id, prompts, reply, deadline=deadline, on_token=on_token, submitted_at=enqueued_at)
+        else:
+            background.submit(_run_job, results, job_id, kind, args, slots)
+
+class InferenceService:
+    """
+    Runs model work in dedicated worker processes so the event loop never
+    waits on generate() or training. Handlers await submit(), which fails fast
+    with InferenceQueueFull when the job queue is full and raises
+    asyncio.TimeoutError when a job takes longer than its timeout. stream()
+    does the same for generation jobs but yields text as it is decoded.
+    """
+    def __init__(self, workers=Config.INFERENCE_WORKERS, max_queue=Config.INFERENCE_QUEUE_SIZE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.started = False
+        self._ids = itertools.count(1)
+        self._pending = {}  # job id -> future
+        self._streams = {}  # job id -> asyncio.Queue of decoded text
+        self._metrics = {}  # job id -> metrics reported by the worker
+        self._processes = []
+
+    def start(self, preload=Config.PRELOAD_MODEL):
+        # spawn so workers don't inherit torch/CUDA state from the server
+        ctx = mp.get_context("spawn")
+        self._loop = asyncio.get_running_loop()
+        self._jobs = ctx.Queue(maxsize=self.max_queue)
+        self._results = ctx.Queue()
+        self._processes = [
+            ctx.Process(target=_worker_main, args=(self._jobs, self._results, preload), daemon=True)
+            for _ in range(self.workers)
+        ]
+        for process in self._processes:
+            process.start()
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+        self.started = True
+
+    async def stop(self):
+        if not self.started:
+            return
+        self.started = False
+        for _ in self._processes:
+            self._jobs.put(None)
+        for process in self._processes:
+            await self._loop.run_in_executor(None, process.join, 10)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(InferenceError("Inference service stopped"))
+        self._pending.clear()
+
+    def _read_results(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            self._loop.call_soon_threadsafe(self._resolve, *message)
+
+    def _resolve(self, job_id, ok, payload, metrics=None):
+        if ok is None:
+            tokens = self._streams.get(job_id)
+            if tokens is not None:
+                tokens.put_nowait(payload)
+            return
+        future = self._pending.pop(job_id, None)
+        if future is None or future.done():
+            # timed out or cancelled while running
+            return
+        if metrics is not None:
+            self._metrics[job_id] = metrics
+        if ok:
+            future.set_result(payload)
+        else:
+            future.set_exception(InferenceError(payload))
+
+    def _enqueue(self, kind, args, timeout, stream=False):
+        if not self.started:
+            raise InferenceError("Inference service is not running")
+
+        job_id = next(self._ids)
+        deadline = time.time() + timeout if timeout else None
+        future = self._loop.create_future()
+        self._pending[job_id] = future
+        try:
+            self._jobs.put_nowait((job_id, kind, args, deadline, stream, time.time()))
+        except queue.Full:
+            del self._pending[job_id]
+            raise InferenceQueueFull(f"Inference queue is full ({self.max_queue} jobs)")
+        return job_id, future
+
+    async def _record(self, kind, job_id, started, outcome, error=None, time_to_first_token=None):
+        if kind == "status":
+            return
+        metrics = self._metrics.pop(job_id, {})
+        await record_llm_call(
+            "local", Config.MODEL_NAME, kind, outcome,
+            prompt_tokens=metrics.get("prompt_tokens", 0),
+            completion_tokens=metrics.get("completion_tokens", 0),
+            queue_wait=metrics.get("queue_wait"),
+            time_to_first_token=time_to_first_token or metrics.get("time_to_first_token"),
+            latency=self._loop.time() - started,
+            error=error
+        )
+
+    async def submit(self, kind, *args, timeout=Config.INFERENCE_TIMEOUT):
+        started = self._loop.time() if self.started else None
+        job_id, future = self._enqueue(kind, args, timeout)
+        try:
+            result = await asyncio.wait_for(future, timeout)
+        except Exception as e:
+            await self._record(kind, job_id, started, "error", f"{type(e).__name__}: {e}"[:500])
+            raise
+        finally:
+            self._pending.pop(job_id, None)
+        await self._record(kind, job_id, started, "ok")
+        return result
+
+    async def stream(self, kind, *args, timeout=Config.INFERENCE_TIMEOUT):
+        """
+        Yields ("token", text) while the job decodes and finally ("done", result).
+        """
+        started = self._loop.time() if self.started else None
+        job_id, future = self._enqueue(kind, args, timeout, stream=True)
+        tokens = asyncio.Queue()
+        self._streams[job_id] = tokens
+        deadline = self._loop.time() + timeout
+        first_token = None
+        try:
+            while True:
+                getter = asyncio.ensure_future(tokens.get())
+                done, _ = await asyncio.wait(
+                    {getter, future},
+                    timeout=max(0, deadline - self._loop.time()),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if getter in done:
+                    first_token = first_token or self._loop.time() - started
+                    yield "token", getter.result()
+                    continue
+                getter.cancel()
+                if future in done:
+                    # tokens always arrive before the result, but drain to be sure
+                    while not tokens.empty():
+                        yield "token", tokens.get_nowait()
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        await self._record(kind, job_id, started, "error", f"{type(e).__name__}: {e}"[:500], first_token)
+                        raise
+                    await self._record(kind, job_id, started, "ok", time_to_first_token=first_token)
+                    yield "done", result
+                    return
+                await self._record(kind, job_id, started, "error", "TimeoutError", first_token)
+                raise asyncio.TimeoutError()
+        finally:
+            self._metrics.pop(job_id, None)
+            self._pending.pop(job_id, None)
+            self._streams.pop(job_id, None)
+
+    def status(self):
+        return {
+            "running": self.started,
+            "workers": [p.is_alive() for p in self._processes],
+            "pending": len(self._pending),
+            "max_queue": self.max_queue,
+        }
+
+# shared instance used by the API handlers
+inference = InferenceService()
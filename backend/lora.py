@@ -1,14 +1,173 @@
 import torch
-from datasets import Dataset
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, TrainingArguments
+from datasets import Dataset, load_from_disk
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, TrainingArguments, DataCollatorForLanguageModeling, TrainerCallback
 from peft import LoraConfig, get_peft_model, PeftModel
 from trl import SFTTrainer
 from config import Config
+import hashlib
+import json
+import os
+import shutil
+import time
 
-def fine_tune_and_save_lora_weights(model_name, data, output_dir="./lora_weights", num_train_epochs=5, max_steps=100):
+def user_lora_weights_dir(user_id):
+    return f"./user_{user_id}/lora_weights"
+
+def has_lora_weights(user_id):
+    return os.path.exists(os.path.join(user_lora_weights_dir(user_id), "adapter_config.json"))
+
+def _versions_dir(output_dir):
+    return os.path.join(os.path.dirname(os.path.abspath(output_dir)), "lora_versions")
+
+def current_adapter_dir(output_dir):
+    """
+    Resolves the published adapter behind output_dir, None if there is none.
+    """
+    if not os.path.exists(os.path.join(output_dir, "adapter_config.json")):
+        return None
+    return os.path.realpath(output_dir)
+
+def _new_version_dir(output_dir):
+    versions_dir = _versions_dir(output_dir)
+    os.makedirs(versions_dir, exist_ok=True)
+    existing = [int(name[1:]) for name in os.listdir(versions_dir) if name.startswith("v") and name[1:].isdigit()]
+    version = max(existing, default=0) + 1
+    return version, os.path.join(versions_dir, f"v{version}")
+
+def publish_adapter(output_dir, version_dir, keep=Config.LORA_KEEP_VERSIONS):
+    """
+    Points output_dir at version_dir by swapping a symlink, so readers see
+    either the old or the new adapter and never a half written one.
+    """
+    output_dir = os.path.abspath(output_dir)
+    if os.path.isdir(output_dir) and not os.path.islink(output_dir):
+        # adapter saved before versioning, keep it as v0
+        os.replace(output_dir, os.path.join(_versions_dir(output_dir), "v0"))
+
+    tmp_link = output_dir + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.relpath(version_dir, os.path.dirname(output_dir)), tmp_link)
+    os.replace(tmp_link, output_dir)
+
+    # drop old versions, the newest `keep` stay around for rollback
+    versions_dir = _versions_dir(output_dir)
+    versions = sorted(
+        (int(name[1:]), name) for name in os.listdir(versions_dir) if name.startswith("v") and name[1:].isdigit()
+    )
+    for _, name in versions[:-keep]:
+        shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+def adapter_version(lora_weights_dir):
+    """
+    Identifies the saved adapter on disk so cached copies can tell when it
+    has been retrained.
+    """
+    config_path = os.path.join(lora_weights_dir, "adapter_config.json")
+    return os.path.realpath(lora_weights_dir), os.path.getmtime(config_path)
+
+MAX_SEQ_LENGTH = 128
+# bump when preprocess_function changes so cached datasets are rebuilt
+PREPROCESS_VERSION = 2
+
+def tokenized_cache_dir(data, model_name):
+    """
+    Location of the tokenized copy of `data`, keyed by a hash of the data,
+    the tokenizer and the preprocessing settings.
+    """
+    key = json.dumps({
+        "data": data,
+        "model": model_name,
+        "max_length": MAX_SEQ_LENGTH,
+        "version": PREPROCESS_VERSION
+    }, sort_keys=True)
+    return os.path.join(Config.TOKENIZED_CACHE_DIR, hashlib.sha256(key.encode()).hexdigest())
+
+def _dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+def evict_tokenized_cache(max_bytes=Config.TOKENIZED_CACHE_MAX_BYTES):
+    """
+    Removes the least recently used tokenized datasets until the cache is
+    under max_bytes. Entries are touched on every use, so mtime orders them.
+    """
+    if not os.path.isdir(Config.TOKENIZED_CACHE_DIR):
+        return
+    entries = []
+    for name in os.listdir(Config.TOKENIZED_CACHE_DIR):
+        path = os.path.join(Config.TOKENIZED_CACHE_DIR, name)
+        if os.path.isdir(path):
+            entries.append((os.path.getmtime(path), _dir_size(path), path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+class TokenCountingCollator:
+    """
+    Wraps a collator and counts real (non-padding) and padded tokens that go
+    through it, for throughput reporting.
+    """
+    def __init__(self, collator):
+        self.collator = collator
+        self.examples = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    def __call__(self, features):
+        batch = self.collator(features)
+        self.examples += batch["input_ids"].shape[0]
+        self.real_tokens += int(batch["attention_mask"].sum())
+        self.padded_tokens += batch["input_ids"].numel()
+        return batch
+
+class TokenThroughputCallback(TrainerCallback):
+    """
+    Prints tokens/sec every logging step. "fixed-128" is how many tokens the
+    same examples cost when everything was padded to MAX_SEQ_LENGTH.
+    """
+    def __init__(self, collator):
+        self.collator = collator
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.started = time.perf_counter()
+        self._mark = (self.started, 0, 0, 0)
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if state.global_step % args.logging_steps == 0:
+            self._report(f"step {state.global_step}", *self._mark)
+            self._mark = (time.perf_counter(), self.collator.examples, self.collator.real_tokens, self.collator.padded_tokens)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self._report("total", self.started, 0, 0, 0)
+
+    def _report(self, label, since, examples, real_tokens, padded_tokens):
+        seconds = max(time.perf_counter() - since, 1e-9)
+        examples = self.collator.examples - examples
+        real_tokens = self.collator.real_tokens - real_tokens
+        padded_tokens = self.collator.padded_tokens - padded_tokens
+        fixed_tokens = examples * MAX_SEQ_LENGTH
+        print(
+            f"[lora {label}] {real_tokens / seconds:.0f} real tokens/s, "
+            f"{padded_tokens / seconds:.0f} padded tokens/s, "
+            f"padding {1 - real_tokens / max(padded_tokens, 1):.1%} "
+            f"(fixed-128 would be {1 - real_tokens / max(fixed_tokens, 1):.1%})"
+        )
+
+def fine_tune_and_save_lora_weights(model_name, data, output_dir="./lora_weights", num_train_epochs=5, max_steps=100, resume=True):
     """
     Fine-tunes the model using the given dataset and saves the LoRA weights.
+    With resume, training continues from the adapter and optimizer state
+    already published at output_dir instead of starting from a new adapter.
+    Each run is saved as a new version and published atomically.
     """
+    parent_dir = current_adapter_dir(output_dir) if resume else None
+    version, version_dir = _new_version_dir(output_dir)
+
     dataset = Dataset.from_list(data)
 
     bnb_config = BitsAndBytesConfig(
@@ -32,44 +191,47 @@ def fine_tune_and_save_lora_weights(model_name, data, output_dir="./lora_weights
 
     def preprocess_function(examples):
         inputs = [f"User: {i} Bot: {o}" for i, o in zip(examples["input"], examples["output"])]
-        labels = ["positive" if f == "like" else "negative" for f in examples["feedback"]]
 
+        # no padding here, the collator pads each batch to its own longest example.
+        # labels are built from input_ids by the collator, which is what the
+        # trainer's default collator already did with the old padded labels
         tokenized_inputs = tokenizer(
             inputs,
             truncation=True,
-            max_length=128,
-            padding="max_length",
-            return_tensors="pt"
-        )
-        tokenized_labels = tokenizer(
-            labels,
-            truncation=True,
-            max_length=128,
-            padding="max_length",
-            return_tensors="pt"
+            max_length=MAX_SEQ_LENGTH
         )
-
-        tokenized_inputs["labels"] = tokenized_labels["input_ids"]
+        tokenized_inputs["length"] = [len(ids) for ids in tokenized_inputs["input_ids"]]
         return tokenized_inputs
 
-    tokenized_dataset = dataset.map(preprocess_function, batched=True)
+    cache_dir = tokenized_cache_dir(data, model_name)
+    if os.path.exists(cache_dir):
+        tokenized_dataset = load_from_disk(cache_dir)
+        os.utime(cache_dir)
+    else:
+        tokenized_dataset = dataset.map(preprocess_function, batched=True)
+        tokenized_dataset.save_to_disk(cache_dir)
+        evict_tokenized_cache()
 
     model.enable_input_require_grads()
 
-    lora_config = LoraConfig(
-        r=8,
-        lora_alpha=32,
-        target_modules=["q_proj", "v_proj"],
-        lora_dropout=0.05,
-        bias="none",
-        task_type="CAUSAL_LM",
-        inference_mode=False
-    )
+    if parent_dir:
+        model = PeftModel.from_pretrained(model, parent_dir, is_trainable=True)
+        print(f"Resuming LoRA training from {parent_dir}")
+    else:
+        lora_config = LoraConfig(
+            r=8,
+            lora_alpha=32,
+            target_modules=["q_proj", "v_proj"],
+            lora_dropout=0.05,
+            bias="none",
+            task_type="CAUSAL_LM",
+            inference_mode=False
+        )
 
-    model = get_peft_model(model, lora_config)
+        model = get_peft_model(model, lora_config)
 
     training_args = TrainingArguments(
-        output_dir=output_dir,
+        output_dir=version_dir,
         num_train_epochs=num_train_epochs,
         per_device_train_batch_size=4,
         gradient_accumulation_steps=16,
@@ -81,7 +243,14 @@ def fine_tune_and_save_lora_weights(model_name, data, output_dir="./lora_weights
         max_steps=max_steps,
         save_steps=50,
         warmup_steps=10,
-        optim="paged_adamw_32bit"
+        optim="paged_adamw_32bit",
+        # batches of similar length, so dynamic padding adds little
+        group_by_length=True,
+        length_column_name="length"
+    )
+
+    collator = TokenCountingCollator(
+        DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False, pad_to_multiple_of=8)
     )
 
     trainer = SFTTrainer(
@@ -89,15 +258,36 @@ def fine_tune_and_save_lora_weights(model_name, data, output_dir="./lora_weights
         train_dataset=tokenized_dataset,
         args=training_args,
         tokenizer=tokenizer,
-        max_seq_length=128,
-        dataset_text_field="input"
+        data_collator=collator,
+        max_seq_length=MAX_SEQ_LENGTH,
+        dataset_text_field="input",
+        callbacks=[TokenThroughputCallback(collator)]
     )
 
+    optimizer_path = os.path.join(parent_dir, "optimizer.pt") if parent_dir else None
+    if optimizer_path and os.path.exists(optimizer_path):
+        trainer.create_optimizer()
+        try:
+            trainer.optimizer.load_state_dict(torch.load(optimizer_path, map_location="cpu"))
+        except (ValueError, KeyError, RuntimeError) as e:
+            print(f"Could not restore optimizer state, starting fresh: {e}")
+            trainer.optimizer = None
+
     model.train()
     trainer.train()
 
-    model.save_pretrained(output_dir)
-    print(f"LoRA weights have been saved to {output_dir}")
+    model.save_pretrained(version_dir)
+    torch.save(trainer.optimizer.state_dict(), os.path.join(version_dir, "optimizer.pt"))
+    with open(os.path.join(version_dir, "lora_meta.json"), "w") as f:
+        json.dump({
+            "version": version,
+            "parent": os.path.basename(parent_dir) if parent_dir else None,
+            "examples": len(data),
+            "base_model": model_name
+        }, f)
+
+    publish_adapter(output_dir, version_dir)
+    print(f"LoRA weights have been saved to {version_dir} and published at {output_dir}")
 
 
 def apply_lora_weights_to_model(base_model_name, lora_weights_dir):
@@ -9,32 +9,30 @@ import jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr
 import uvicorn
-import shutil
 import os
 
-import zipfile
-from pathlib import Path
-import io
-
 import models
 import database
 from database import engine, get_db
 from models import User, UserRole, Course, Section, Page, Enrollment, Quiz, QuizQuestion, QuizQuestionChoice, QuizResult  # update imports
-from utils.grok import query_grok, process_pdf_content, generate_quiz, generate_course_details
-from utils.pdf_processor import process_pdf, process_pdfs
-import PyPDF2
+from utils.grok import query_grok, generate_quiz, generate_course_details, summarize_content, section_budget, start_client, close_client, rate_limiter, PRIORITY_BULK
+from utils.chunking import chunk_text
+from utils.pdf_extract import extract_into, read_upload, shutdown_pool, UploadRejected, EXTRACTION_DONE
 
 import logging
 from jose import JWTError, jwt  # replace the existing jwt import
 
-import tempfile
 import json
 
 from sse_starlette.sse import EventSourceResponse
 
 import asyncio  # Add this at the top
 
-from generate_answer import generate_initial_note, load_base_model, load_user_model, generate_note, fine_tune_model
+from inference import inference, InferenceQueueFull, InferenceError
+from training import training_queue
+from note_cache import base_notes, precompute_course_notes
+from config import Config
+from utils.telemetry import current_course_id, current_user_id, llm_metrics
 
 # setup logging
 logger = logging.getLogger(__name__)
@@ -69,6 +67,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_inference():
+    # workers load the base model once so requests don't pay for it
+    inference.start()
+    training_queue.start()
+
+@app.on_event("startup")
+async def start_grok_client():
+    await start_client()
+
+@app.on_event("shutdown")
+async def stop_inference():
+    for task in background_tasks:
+        task.cancel()
+    await training_queue.stop()
+    await inference.stop()
+
+@app.on_event("shutdown")
+async def stop_grok_client():
+    await close_client()
+
+@app.on_event("shutdown")
+async def stop_pdf_extraction():
+    shutdown_pool()
+
 # schemas
 class UserCreate(BaseModel):
     email: EmailStr
@@ -97,6 +120,63 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 def get_user(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
+# fire-and-forget work started by handlers, the loop only keeps weak references to tasks
+background_tasks = set()
+
+def _background_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task failed: {task.exception()}")
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+async def run_inference(kind: str, *args, timeout: float = Config.INFERENCE_TIMEOUT):
+    try:
+        return await inference.submit(kind, *args, timeout=timeout)
+    except InferenceQueueFull:
+        raise HTTPException(status_code=503, detail="Note generation is busy, please try again shortly")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Note generation timed out")
+    except InferenceError as e:
+        logger.error(f"Inference job {kind} failed: {e}")
+        raise HTTPException(status_code=500, detail="Note generation failed")
+
+async def stream_inference(kind: str, *args, on_done=None, to_result=None, timeout: float = Config.INFERENCE_TIMEOUT):
+    # sse events for a streamed generation job, to_result maps the final result
+    # to what the non-streamed endpoint returns and on_done gets it
+    try:
+        async for event, payload in inference.stream(kind, *args, timeout=timeout):
+            if event == "token":
+                yield json.dumps({"type": "token", "text": payload})
+            else:
+                if to_result is not None:
+                    payload = to_result(payload)
+                if on_done is not None:
+                    on_done(payload)
+                yield json.dumps({"type": "done", "message": payload})
+    except InferenceQueueFull:
+        yield json.dumps({"type": "error", "message": "Note generation is busy, please try again shortly"})
+    except asyncio.TimeoutError:
+        yield json.dumps({"type": "error", "message": "Note generation timed out"})
+    except InferenceError as e:
+        logger.error(f"Inference job {kind} failed: {e}")
+        yield json.dumps({"type": "error", "message": "Note generation failed"})
+
+async def cached_base_notes(db: Session, page_contents: list[str]):
+    try:
+        return await base_notes(db, page_contents)
+    except InferenceQueueFull:
+        raise HTTPException(status_code=503, detail="Note generation is busy, please try again shortly")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Note generation timed out")
+    except InferenceError as e:
+        logger.error(f"Base note generation failed: {e}")
+        raise HTTPException(status_code=500, detail="Note generation failed")
+
 def get_note(db: Session, note_id: int, user_id: int):
     return db.query(models.Note).filter(models.Note.id == note_id and models.Note.student_id == user_id).first()
 
@@ -125,7 +205,9 @@ async def get_current_user(
     user = db.query(User).filter(User.email == email).first()
     if user is None:
         raise credentials_exception
-        
+
+    # LLM calls made for this request are attributed to the user
+    current_user_id.set(user.id)
     return user
 
 # endpoints
@@ -314,62 +396,25 @@ async def create_course(
     title: str = Form(...),
     description: str = Form(...),
     content: UploadFile = File(...),
+    # skip the LLM response cache and generate everything again
+    regenerate: bool = Form(False),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     loop = asyncio.get_event_loop()
 
-    # Function to process the uploaded file synchronously
-    def process_uploaded_file(content: UploadFile, temp_dir_path: str) -> list[tuple[str, str]]:
-        try:
-            file_path = Path(temp_dir_path) / content.filename
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(content.file, buffer)
-
-            pdf_contents = []  # list of (filename, content) tuples
-            
-            if content.filename.endswith('.zip'):
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    for file in zip_ref.namelist():
-                        if file.endswith('.pdf'):
-                            zip_ref.extract(file, temp_dir_path)
-                            pdf_path = Path(temp_dir_path) / file
-                            with open(pdf_path, 'rb') as pdf_file:
-                                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                                section_content = ""
-                                for page in pdf_reader.pages:
-                                    text = page.extract_text()
-                                    if text:
-                                        section_content += text + "\n\n"
-                                if section_content:
-                                    pdf_contents.append((Path(file).stem, section_content))
-            else:
-                with open(file_path, 'rb') as pdf_file:
-                    pdf_reader = PyPDF2.PdfReader(pdf_file)
-                    section_content = ""
-                    for page in pdf_reader.pages:
-                        text = page.extract_text()
-                        if text:
-                            section_content += text + "\n\n"
-                    if section_content:
-                        pdf_contents.append((Path(content.filename).stem, section_content))
-            
-            return pdf_contents
-
-        finally:
-            content.file.close()
-
-    # Run the file processing in a separate thread to avoid blocking
+    # Read the PDFs straight from the spooled upload in a separate thread, their
+    # text is extracted while the course is generated
     try:
-        pdf_contents = await loop.run_in_executor(
-            None,
-            process_uploaded_file,
-            content,
-            tempfile.mkdtemp()
-        )
+        pdf_files = await loop.run_in_executor(None, read_upload, content.file, content.filename)
+    except UploadRejected as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing uploaded file: {e}")
         raise HTTPException(status_code=500, detail="Error processing uploaded file.")
+    finally:
+        # removes the spooled copy if the upload was big enough to hit the disk
+        content.file.close()
 
     async def generate_with_progress():
         try:
@@ -382,101 +427,238 @@ async def create_course(
             db.add(course)
             db.commit()
             db.refresh(course)
+            current_course_id.set(course.id)
 
             # Send the course ID immediately after creation
             yield json.dumps({
                 "courseId": course.id
             })
 
-            # Generate course details using combined content from all PDFs
-            all_content = "\n\n".join([content for _, content in pdf_contents])
-            course_details = await generate_course_details(title, all_content)
-            
-            # Update course with generated details
-            course.difficulty = course_details.get("difficulty")
-            course.estimated_hours = course_details.get("estimated_hours")
-            course.learning_outcomes = course_details.get("learning_outcomes", [])
-            db.commit()
-
-            # Send progress update for course details completion
-            yield json.dumps({
-                "type": "details",
-                "status": "completed",
-                "stats": {
-                    "difficulty": course_details.get("difficulty"),
-                    "estimatedHours": course_details.get("estimated_hours"),
-                    "outcomesCount": len(course_details.get("learning_outcomes", [])),
-                    "step": "Course details generated."
-                }
-            })
+            # Ingestion runs as a pipeline: PDFs are extracted on the process
+            # pool and each one flows into section creation and page generation
+            # as soon as it is parsed. extracted_sections is bounded and only
+            # read while generation keeps up, so extraction waits when the LLM
+            # side is behind. Tasks report through page_events, rows are
+            # written here as results come in.
+            extracted_sections = asyncio.Queue(maxsize=Config.PIPELINE_QUEUE_SIZE)
+            page_events = asyncio.Queue()
+            llm_slots = asyncio.Semaphore(Config.COURSE_GENERATION_CONCURRENCY)
+            extraction = asyncio.create_task(extract_into(extracted_sections, pdf_files))
 
-            # Continue with section creation
-            total_sections = len(pdf_contents)
             pages_per_section = 3
-            total_pages = total_sections * pages_per_section
-            current_page = 0
+            expected_sections = len(pdf_files)  # empty PDFs are dropped once extracted
+            total_pages = expected_sections * pages_per_section
+            current_page = 0  # pages completed so far
+            pages_waiting = 0  # page tasks not yet holding an LLM slot
             total_word_count = 0
+            total_token_count = 0
+
+            async def generate_page(section_num, section_title, page_num):
+                last_report = 0
+                tokens = 0  # kept per chunk, reports are throttled but the final count isn't
+
+                async def report_progress(partial_text, token_count):
+                    # streamed completions call this per chunk, pass on a few per second
+                    nonlocal last_report, tokens
+                    tokens = token_count
+                    now = loop.time()
+                    if now - last_report >= 0.5:
+                        last_report = now
+                        await page_events.put(("progress", section_num, section_title, page_num, (partial_text, token_count)))
+
+                try:
+                    async with llm_slots:
+                        await page_events.put(("started", section_num, section_title, page_num, None))
+                        content_text = await query_grok(
+                            page_prompt(page_num, section_title, title),
+                            priority=PRIORITY_BULK,
+                            refresh=regenerate,
+                            on_progress=report_progress
+                        )
+                    await page_events.put(("completed", section_num, section_title, page_num, (content_text, tokens)))
+                except Exception as e:
+                    await page_events.put(("failed", section_num, section_title, page_num, e))
+
+            # one quiz per section, queued behind the pages on the same LLM slots
+            # each section is summarized once, to its share of the prompt budget
+            # so all of them fit together, and the section's quiz and the
+            # course details both use that summary
+            async def summarize_section(section_content, budget):
+                try:
+                    return await summarize_content(section_content, budget, PRIORITY_BULK, regenerate, llm_slots=llm_slots)
+                except Exception as e:
+                    logger.error(f"Failed to summarize section, using its start instead: {e}")
+                    return chunk_text(section_content, budget)[0]
+
+            async def generate_section_quiz(section_num, section_title, summary_task):
+                section_summary = await summary_task
+                async with llm_slots:
+                    questions = await generate_quiz([(section_title, section_summary)], refresh=regenerate)
+                return section_num, section_title, questions
+
+            # course details need every section, they start once extraction is done
+            async def generate_details(section_summaries, material_words):
+                try:
+                    summaries = await asyncio.gather(*(summary_task for _, summary_task in section_summaries))
+                    all_content = "\n\n".join(
+                        f"{section_title}:\n{summary}" for (section_title, _), summary in zip(section_summaries, summaries)
+                    )
+                    async with llm_slots:
+                        course_details = await generate_course_details(title, all_content, refresh=regenerate, word_count=material_words)
+                    await page_events.put(("details", None, None, None, course_details))
+                except Exception as e:
+                    await page_events.put(("failed", None, None, None, e))
+
+            sections = {}  # section number (upload order) -> Section
+            section_summaries = {}  # section number -> task summarizing its content
+            material_words = 0  # words in the uploaded material, for the details fallback
+            summary_budget = section_budget(expected_sections)
+            page_tasks = []
+            quiz_tasks = []
+            details_task = None
+            details_done = False
+            extraction_finished = False
+            # words and tokens streamed so far for pages still being generated
+            in_flight = {}
+            next_section = None
+            next_event = None
+
+            try:
+                while not (details_done and current_page == total_pages):
+                    waiting_on = set()
+                    if not extraction_finished and pages_waiting < Config.COURSE_GENERATION_CONCURRENCY:
+                        next_section = next_section or asyncio.ensure_future(extracted_sections.get())
+                        waiting_on.add(next_section)
+                    next_event = next_event or asyncio.ensure_future(page_events.get())
+                    waiting_on.add(next_event)
+                    done, _ = await asyncio.wait(waiting_on, return_when=asyncio.FIRST_COMPLETED)
+
+                    if next_section in done:
+                        item, next_section = next_section.result(), None
+                        if isinstance(item, Exception):
+                            raise item
+
+                        if item is EXTRACTION_DONE:
+                            # every PDF is in, the totals are final now
+                            extraction_finished = True
+                            expected_sections = len(sections)
+                            total_pages = expected_sections * pages_per_section
+                            ordered = [(sections[num].title, section_summaries[num]) for num in sorted(sections)]
+                            details_task = asyncio.create_task(generate_details(ordered, material_words))
+                        else:
+                            section_num, pdf = item
+                            logger.info(f"Extracted {len(pdf.pages)} pages from {pdf.name} in {pdf.seconds:.2f}s{' (cached)' if pdf.cached else ''}")
+                            section_title, section_content = pdf.name, pdf.text
+                            if not section_content:
+                                expected_sections -= 1
+                                total_pages = max(expected_sections, len(sections)) * pages_per_section
+                            else:
+                                # Section creation progress
+                                yield json.dumps({
+                                    "type": "content",
+                                    "status": "creating_section",
+                                    "stats": {
+                                        "sectionCount": len(sections) + 1,
+                                        "totalSections": expected_sections,
+                                        "pageCount": current_page,
+                                        "totalPages": total_pages,
+                                        "percentage": round(((len(sections) + 1) / max(expected_sections, 1)) * 100, 1),
+                                        "currentSection": section_title,
+                                        "step": f"Creating section: {section_title}",
+                                        "wordCount": total_word_count
+                                    }
+                                })
+
+                                section = Section(title=section_title, order=section_num, course_id=course.id)
+                                db.add(section)
+                                db.commit()
+                                db.refresh(section)
+                                sections[section_num] = section
+                                material_words += len(section_content.split())
+                                section_summaries[section_num] = asyncio.create_task(
+                                    summarize_section(section_content, summary_budget)
+                                )
+
+                                page_tasks.extend(
+                                    asyncio.create_task(generate_page(section_num, section_title, page_num))
+                                    for page_num in range(pages_per_section)
+                                )
+                                pages_waiting += pages_per_section
+                                quiz_tasks.append(asyncio.create_task(
+                                    generate_section_quiz(section_num, section_title, section_summaries[section_num])
+                                ))
+
+                    if next_event not in done:
+                        continue
+                    (event, section_num, section_title, page_num, result), next_event = next_event.result(), None
+
+                    if event == "failed":
+                        raise result
+
+                    if event == "details":
+                        course_details = result
+                        details_done = True
+
+                        # Update course with generated details
+                        course.difficulty = course_details.get("difficulty")
+                        course.estimated_hours = course_details.get("estimated_hours")
+                        course.learning_outcomes = course_details.get("learning_outcomes", [])
+                        db.commit()
 
-            for section_num, (section_title, section_content) in enumerate(pdf_contents, 1):
-                # Section creation progress
-                yield json.dumps({
-                    "type": "content",
-                    "status": "creating_section",
-                    "stats": {
-                        "sectionCount": section_num,
-                        "totalSections": total_sections,
-                        "pageCount": current_page,
-                        "totalPages": total_pages,
-                        "percentage": round((section_num / total_sections) * 100, 1),
-                        "currentSection": section_title,
-                        "step": f"Creating section: {section_title}",
-                        "wordCount": total_word_count
-                    }
-                })
-                await asyncio.sleep(0.2)
-
-                section = Section(title=section_title, order=section_num, course_id=course.id)
-                db.add(section)
-                db.commit()
-                db.refresh(section)
-
-                for page_num in range(pages_per_section):
+                        # Send progress update for course details completion
+                        yield json.dumps({
+                            "type": "details",
+                            "status": "completed",
+                            "stats": {
+                                "difficulty": course_details.get("difficulty"),
+                                "estimatedHours": course_details.get("estimated_hours"),
+                                "outcomesCount": len(course_details.get("learning_outcomes", [])),
+                                "step": "Course details generated."
+                            }
+                        })
+                        continue
+
+                    if event in ("started", "progress"):
+                        preview = ""
+                        if event == "started":
+                            pages_waiting -= 1
+                        else:
+                            partial_text, token_count = result
+                            in_flight[(section_num, page_num)] = (len(partial_text.split()), token_count)
+                            preview = partial_text[-200:]
+
+                        # Page generation progress, live counts include in-flight pages
+                        yield json.dumps({
+                            "type": "content",
+                            "status": "generating_page",
+                            "stats": {
+                                "sectionCount": len(sections),
+                                "totalSections": expected_sections,
+                                "pageCount": current_page,
+                                "totalPages": total_pages,
+                                "currentSection": section_title,
+                                "currentPage": f"Page {page_num + 1}",
+                                "percentage": round((current_page / max(total_pages, 1)) * 100, 1),
+                                "step": f"Generating content for {section_title} - page {page_num + 1}",
+                                "wordCount": total_word_count,
+                                "liveWordCount": total_word_count + sum(words for words, _ in in_flight.values()),
+                                "liveTokenCount": total_token_count + sum(tokens for _, tokens in in_flight.values()),
+                                "preview": preview
+                            }
+                        })
+                        continue
+
+                    in_flight.pop((section_num, page_num), None)
+                    content_text, page_tokens = result
                     current_page += 1
-
-                    # Page generation progress
-                    yield json.dumps({
-                        "type": "content",
-                        "status": "generating_page",
-                        "stats": {
-                            "sectionCount": section_num,
-                            "totalSections": total_sections,
-                            "pageCount": current_page,
-                            "totalPages": total_pages,
-                            "currentSection": section_title,
-                            "currentPage": f"Page {page_num + 1}",
-                            "percentage": round((current_page / total_pages) * 100, 1),
-                            "step": f"Generating content for {section_title} - page {page_num + 1}",
-                            "wordCount": total_word_count
-                        }
-                    })
-                    await asyncio.sleep(0.2)
-
-                    # Generate page content
-                    page_prompts = {
-                        0: f"generate an overview and introduction for the '{section_title}' section about {title}.",
-                        1: f"generate detailed explanations and examples for the '{section_title}' section about {title}.",
-                        2: f"generate practical applications and key takeaways for the '{section_title}' section about {title}."
-                    }
-                    content_text = await query_grok(page_prompts[page_num])
-
-                    # Update word count before creating the page
                     total_word_count += len(content_text.split())
+                    total_token_count += page_tokens
 
-                    # Create page
+                    # Create page, order comes from its slot so completion order doesn't matter
                     page = Page(
                         content=content_text,
                         order=page_num + 1,
-                        section_id=section.id,
+                        section_id=sections[section_num].id,
                         course_id=course.id
                     )
                     db.add(page)
@@ -487,18 +669,30 @@ async def create_course(
                         "type": "content",
                         "status": "page_completed",
                         "stats": {
-                            "sectionCount": section_num,
-                            "totalSections": total_sections,
+                            "sectionCount": len(sections),
+                            "totalSections": expected_sections,
                             "pageCount": current_page,
                             "totalPages": total_pages,
                             "currentSection": section_title,
                             "currentPage": f"Page {page_num + 1}",
-                            "percentage": round((current_page / total_pages) * 100, 1),
+                            "percentage": round((current_page / max(total_pages, 1)) * 100, 1),
                             "wordCount": total_word_count,
+                            "liveWordCount": total_word_count + sum(words for words, _ in in_flight.values()),
+                            "liveTokenCount": total_token_count + sum(tokens for _, tokens in in_flight.values()),
                             "step": f"Completed {section_title} - page {page_num + 1}"
                         }
                     })
-                    await asyncio.sleep(0.2)
+            except BaseException:
+                for task in [*quiz_tasks, *section_summaries.values()]:
+                    task.cancel()
+                raise
+            finally:
+                for task in [extraction, details_task, next_section, next_event, *page_tasks]:
+                    if task is not None:
+                        task.cancel()
+
+            # warm the shared note cache so enrolling doesn't wait on generation
+            run_in_background(precompute_course_notes(course.id))
 
             # Final content completion message
             yield json.dumps({
@@ -513,65 +707,76 @@ async def create_course(
                 }
             })
 
-            # Generate and save quiz
+            # Save each section's quiz as it comes in
             yield json.dumps({
                 "type": "quiz",
                 "status": "pending"
             })
-            async def progress_callback(data):
-                yield json.dumps(data)
-
-            # Define progress callback as a regular async function
-            async def progress_callback(data):
-                yield json.dumps(data)
-                await asyncio.sleep(0.1)  # small delay to prevent flooding
-
-            # Generate and save quiz
-            questions_data = await generate_quiz(
-                pdf_contents, 
-                progress_callback=lambda data: yield_progress(data)  # use the wrapper
-            )
 
-            # Create quiz with both section_id and course_id
-            quiz = Quiz(
-                section_id=section.id,
-                course_id=course.id
-            )
-            db.add(quiz)
-            db.commit()
-            db.refresh(quiz)
-
-            # Create questions with their choices
-            for q_data in questions_data:
-                # Create the question
-                question = QuizQuestion(
-                    quiz_id=quiz.id,
-                    question=q_data['question']
-                )
-                db.add(question)
-                db.commit()
-                db.refresh(question)
-
-                # Create choices for the question
-                for i, option_text in enumerate(q_data['options']):
-                    choice = QuizQuestionChoice(
-                        quiz_question_id=question.id,
-                        content=option_text
-                    )
-                    db.add(choice)
-                    db.commit()
-
-                    # If this is the correct answer, update the question
-                    if i == q_data['correctAnswer']:
-                        question.correct_choice_id = choice.id
+            total_questions = 0
+            sections_done = 0
+            try:
+                for next_quiz in asyncio.as_completed(quiz_tasks):
+                    section_num, section_title, questions_data = await next_quiz
+                    sections_done += 1
+
+                    # generate_quiz returns no questions when it failed
+                    if questions_data:
+                        quiz = Quiz(
+                            section_id=sections[section_num].id,
+                            course_id=course.id
+                        )
+                        db.add(quiz)
                         db.commit()
+                        db.refresh(quiz)
+
+                        # Create questions with their choices
+                        for q_data in questions_data:
+                            # Create the question
+                            question = QuizQuestion(
+                                quiz_id=quiz.id,
+                                question=q_data['question']
+                            )
+                            db.add(question)
+                            db.commit()
+                            db.refresh(question)
+
+                            # Create choices for the question
+                            for i, option_text in enumerate(q_data['options']):
+                                choice = QuizQuestionChoice(
+                                    quiz_question_id=question.id,
+                                    content=option_text
+                                )
+                                db.add(choice)
+                                db.commit()
+
+                                # If this is the correct answer, update the question
+                                if i == q_data['correctAnswer']:
+                                    question.correct_choice_id = choice.id
+                                    db.commit()
+                        total_questions += len(questions_data)
+
+                    yield json.dumps({
+                        "type": "quiz",
+                        "status": "in_progress",
+                        "stats": {
+                            "step": f"Quiz for {section_title} {'generated' if questions_data else 'failed'} ({sections_done}/{len(sections)})",
+                            "sectionCount": sections_done,
+                            "totalSections": len(sections),
+                            "questionCount": total_questions
+                        }
+                    })
+            finally:
+                for task in [*quiz_tasks, *section_summaries.values()]:
+                    task.cancel()
 
             yield json.dumps({
                 "type": "quiz",
                 "status": "completed",
                 "stats": {
-                    "questionCount": len(questions_data),
-                    "optionCount": len(questions_data) * 4
+                    "step": "Quiz generation complete",
+                    "questionCount": total_questions,
+                    "optionCount": total_questions * 4
                 }
             })
 
@@ -583,12 +788,16 @@ async def create_course(
             })
             raise HTTPException(status_code=500, detail=str(e))
 
-    # Wrapper function to handle the yielding
-    async def yield_progress(data):
-        yield json.dumps(data)
-
     return EventSourceResponse(generate_with_progress())
 
+def page_prompt(page_num: int, section_title: str, title: str) -> str:
+    page_prompts = {
+        0: f"generate an overview and introduction for the '{section_title}' section about {title}.",
+        1: f"generate detailed explanations and examples for the '{section_title}' section about {title}.",
+        2: f"generate practical applications and key takeaways for the '{section_title}' section about {title}."
+    }
+    return page_prompts[page_num]
+
 # 2. Then, define all parameterized routes
 @app.get("/courses/{course_id}")
 async def get_course(
@@ -620,6 +829,7 @@ async def get_course(
                 "pages": [
                     {
                         "id": page.id,
+                        "order": page.order,
                         "content": page.content
                     } for page in section.pages
                 ]
@@ -762,14 +972,48 @@ After signing with Interscope Records in 2007, Gaga achieved global recognition
     db.commit()
     return
 
+@app.get("/health")
+async def health():
+    return {"status": "ok", "inference": inference.status(), "llm_rate_limit": rate_limiter.status()}
+
+@app.get("/metrics/llm")
+async def llm_call_metrics(
+    hours: Optional[float] = None,
+    course_id: Optional[int] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    since = datetime.utcnow() - timedelta(hours=hours) if hours else None
+    # students only see their own calls, professors their own and their courses'
+    if current_user.role == UserRole.STUDENT:
+        return llm_metrics(db, since=since, course_id=course_id, user_id=current_user.id)
+    if course_id is not None:
+        course = db.query(Course).filter(Course.id == course_id).first()
+        if not course:
+            raise HTTPException(status_code=404, detail="Course not found")
+        if course.professor_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Not authorized to view this course's metrics")
+    return llm_metrics(db, since=since, course_id=course_id, professor_id=current_user.id)
+
+@app.get("/models/status")
+async def models_status():
+    return {
+        "inference": inference.status(),
+        "model": await run_inference("status", timeout=30)
+    }
+
 @app.get("/note")
-async def note(db: Session = Depends(get_db)):
+async def note(stream: bool = False, db: Session = Depends(get_db)):
     page = db.query(models.Page).filter(models.Page.id == 1).first()
     if page is None:
         raise HTTPException(status_code=500, detail="Feedback done for a page note that doesn't exists")
     # note = generate_note(page.content, old_note.content, model, tokenizer)
-    model, tokenizer = load_base_model()
-    note = generate_initial_note(page.content, model, tokenizer)
+    if stream:
+        return EventSourceResponse(
+            stream_inference("initial_notes", None, [page.content], to_result=lambda notes: notes[0])
+        )
+    notes = await run_inference("initial_notes", None, [page.content])
+    note = notes[0]
 
     return {"note": note}
 
@@ -778,6 +1022,8 @@ class FeedbackCreate(BaseModel):
     note_id: int
     like: bool
     message: Optional[str] = None
+    # stream the regenerated note as server-sent events
+    stream: bool = False
 
 @app.post("/feedback")
 async def feedback(fb: FeedbackCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -800,45 +1046,53 @@ async def feedback(fb: FeedbackCreate, current_user: User = Depends(get_current_
     db.commit()
 
     if not fb.like:
-        if os.path.exists(os.path.join(f"./user_{current_user.id}/lora_weights")):
-            model, tokenizer = load_user_model(current_user.id)
-        else:
-            model, tokenizer = load_base_model()
         old_note = db.query(models.Note).filter(models.Note.id == fb.note_id).first()
         page = db.query(models.Page).filter(models.Page.id == old_note.page_id).first()
         if page is None:
             raise HTTPException(status_code=500, detail="Feedback done for a page note that doesn't exists")
-        note = generate_note(page.content, old_note.content, model, tokenizer)
-        new_page = models.Note(
-            student_id=current_user.id,
-            page_id=page.id,
-            content=note,
-        )
-        db.add(new_page)
-        db.commit()
+        def save_note(note):
+            new_page = models.Note(
+                student_id=current_user.id,
+                page_id=page.id,
+                content=note,
+            )
+            db.add(new_page)
+            db.commit()
+
+        if fb.stream:
+            return EventSourceResponse(
+                stream_inference("note", current_user.id, page.content, old_note.content, on_done=save_note)
+            )
+        note = await run_inference("note", current_user.id, page.content, old_note.content)
+        save_note(note)
         resp['message'] = note
     else:
-        # get all feedback from db and format for fine tuning
-        feedbacks = db.query(models.Feedback).filter(models.User.id == current_user.id).all()
-        input = []
-        for feedback in feedbacks:
-            note = db.query(models.Note).filter(models.Note.id == feedback.note_id).first()
-            if note is None:
-                continue
-            page = db.query(models.Page).filter(models.Page.id == note.page_id).first()
-            if page is None:
-                continue
-            input.append({
-                "input": f"Generate notes for the given content: {page.content}",
-                "output": note.content,
-                "feedback": "like" if feedback.like is not None and feedback.like == True else "dislike"
-            })
-        fine_tune_model(current_user.id, input)
-        db.query(models.Feedback).delete(models.Feedback.student_id == current_user.id)
-        db.commit()
+        # fine tuning runs in the background, repeated likes share one run
+        job = training_queue.request(db, current_user.id)
+        resp['training_job_id'] = job.id
 
     return resp
 
+@app.get("/training/jobs")
+async def get_training_jobs(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    jobs = db.query(models.TrainingJob).filter(
+        models.TrainingJob.student_id == current_user.id
+    ).order_by(models.TrainingJob.id.desc()).limit(10).all()
+
+    return [
+        {
+            "id": job.id,
+            "status": job.status,
+            "requested_count": job.requested_count,
+            "feedback_count": job.feedback_count,
+            "error": job.error,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at
+        }
+        for job in jobs
+    ]
+
 @app.post("/quizzes/{quiz_id}/submit")
 async def submit_quiz(
     quiz_id: int,
@@ -912,8 +1166,11 @@ async def get_section_quiz(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # get quiz for the course
-    quiz = db.query(Quiz).filter(Quiz.course_id == course_id).first()
+    # get quiz for the section
+    quiz = db.query(Quiz).filter(
+        Quiz.course_id == course_id,
+        Quiz.section_id == section_id
+    ).order_by(Quiz.id.desc()).first()
     if not quiz:
         raise HTTPException(status_code=404, detail="Quiz not found")
 
@@ -961,6 +1218,7 @@ async def enroll_in_course(
             status_code=404,
             detail="Course not found"
         )
+    current_course_id.set(course_id)
     
     # check if already enrolled
     existing_enrollment = db.query(Enrollment).filter(
@@ -985,12 +1243,13 @@ async def enroll_in_course(
 
     # generate initial notes
     pages = db.query(models.Page).filter(models.Page.course_id == course_id).all()
+    page_contents = [page.content for page in pages]
     if os.path.exists(os.path.join(f"./user_{current_user.id}/lora_weights")):
-        model, tokenizer = load_user_model(current_user.id)
+        notes = await run_inference("initial_notes", current_user.id, page_contents)
     else:
-        model, tokenizer = load_base_model()
-    for page in pages:
-        note = generate_initial_note(page.content, model, tokenizer)
+        # base model notes are the same for everyone, reuse them
+        notes = await cached_base_notes(db, page_contents)
+    for page, note in zip(pages, notes):
         n = models.Note(
             page_id=page.id,
             student_id=current_user.id,
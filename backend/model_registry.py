@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import OrderedDict
+
+import psutil
+from peft import PeftModel
+
+from config import Config
+from generate_answer import load_base_model
+from lora import user_lora_weights_dir, has_lora_weights, adapter_version
+
+# peft's name for "no adapter" in mixed-adapter batches
+BASE_ADAPTER = "__base__"
+
+class AdapterCache:
+    """
+    Keeps up to `capacity` per-user LoRA adapters attached to one shared base
+    model. Batch rows pick their adapter by name, the least recently used
+    adapter is dropped when full.
+    """
+    def __init__(self, capacity=Config.ADAPTER_CACHE_SIZE):
+        self.capacity = max(1, capacity)
+        self.peft_model = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._adapters = OrderedDict()  # adapter name -> version on disk
+
+    def ensure(self, base_model, user_id, pinned=()):
+        """
+        Attaches the user's adapter if needed and returns its name. Adapters in
+        `pinned` are in use by a running batch, so they are neither evicted nor
+        swapped for a retrained version until they are released.
+        """
+        name = f"user_{user_id}"
+        lora_weights_dir = user_lora_weights_dir(user_id)
+        version = adapter_version(lora_weights_dir)
+
+        if self._adapters.get(name) == version or (name in self._adapters and name in pinned):
+            self.hits += 1
+            self._adapters.move_to_end(name)
+            return name
+
+        self.misses += 1
+        if name in self._adapters:
+            # retrained since we loaded it
+            self._unload(name)
+        self._load(base_model, name, lora_weights_dir)
+        self._adapters[name] = version
+
+        evictable = [n for n in self._adapters if n != name and n not in pinned]
+        while len(self._adapters) > self.capacity and evictable:
+            self._unload(evictable.pop(0))
+            self.evictions += 1
+        return name
+
+    def _load(self, base_model, name, lora_weights_dir):
+        if self.peft_model is None:
+            self.peft_model = PeftModel.from_pretrained(base_model, lora_weights_dir, adapter_name=name)
+        else:
+            self.peft_model.load_adapter(lora_weights_dir, adapter_name=name)
+        self.peft_model.eval()
+
+    def _unload(self, name):
+        # peft refuses to delete the active adapter, so point at another one first
+        if self.peft_model.active_adapter == name:
+            other = next((n for n in self._adapters if n != name), None)
+            if other is not None:
+                self.peft_model.set_adapter(other)
+        self.peft_model.delete_adapter(name)
+        del self._adapters[name]
+
+    def status(self):
+        return {
+            "capacity": self.capacity,
+            "size": len(self._adapters),
+            "adapters": list(self._adapters),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+class ModelRegistry:
+    """
+    Process-wide holder for the base model so it is loaded once and shared
+    between requests instead of being reloaded from disk every time.
+    """
+    def __init__(self, model_name=Config.MODEL_NAME):
+        self.model_name = model_name
+        self.state = "not_loaded"  # not_loaded -> loading -> loaded | failed
+        self.error = None
+        self.load_seconds = None
+        self.loaded_at = None
+        self.model_bytes = None
+        self.rss_delta_bytes = None
+
+        self.adapters = AdapterCache()
+
+        self._model = None
+        self._tokenizer = None
+        # guards loading
+        self._load_lock = threading.Lock()
+        # serializes use of the shared model
+        self.lock = threading.RLock()
+
+    @property
+    def is_loaded(self):
+        return self.state == "loaded"
+
+    def load(self):
+        """
+        Loads the base model if it is not loaded yet. Safe to call from
+        several threads, only the first call does the work.
+        """
+        if self._model is not None:
+            return self._model, self._tokenizer
+
+        with self._load_lock:
+            if self._model is not None:
+                return self._model, self._tokenizer
+
+            self.state = "loading"
+            self.error = None
+            process = psutil.Process()
+            rss_before = process.memory_info().rss
+            started = time.perf_counter()
+            try:
+                model, tokenizer = load_base_model()
+                model.eval()
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                raise
+
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            self.loaded_at = time.time()
+            self.rss_delta_bytes = process.memory_info().rss - rss_before
+            self.model_bytes = model.get_memory_footprint()
+            self._model, self._tokenizer = model, tokenizer
+            self.state = "loaded"
+            print(f"Loaded {self.model_name} in {self.load_seconds}s ({self.model_bytes / 1e9:.2f} GB)")
+            return model, tokenizer
+
+    def batch_adapter(self, user_id, pinned=()):
+        """
+        Resolves the adapter a user's rows should use in a mixed batch, either
+        their adapter name or BASE_ADAPTER. Callers must hold the model lock.
+        """
+        if user_id is None or not has_lora_weights(user_id):
+            return BASE_ADAPTER
+        return self.adapters.ensure(self.load()[0], user_id, pinned=pinned)
+
+    def batch_model(self):
+        """
+        Returns the model to run mixed-adapter batches on: the peft wrapper
+        once any adapter has been attached, the plain base model before that.
+        """
+        model, tokenizer = self.load()
+        return self.adapters.peft_model or model, tokenizer
+
+    def status(self):
+        return {
+            "model": self.model_name,
+            "state": self.state,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "loaded_at": self.loaded_at,
+            "model_bytes": self.model_bytes,
+            "rss_delta_bytes": self.rss_delta_bytes,
+            "process_rss_bytes": psutil.Process().memory_info().rss,
+            "adapters": self.adapters.status(),
+        }
+
+# shared instance for the whole process
+registry = ModelRegistry()
@@ -83,7 +83,8 @@ class Section(Base):
 
     # relationships
     course = relationship("Course", back_populates="sections")
-    pages = relationship("Page", back_populates="section")
+    # pages are generated concurrently and inserted as they finish
+    pages = relationship("Page", back_populates="section", order_by="Page.order")
     quizzes = relationship("Quiz", back_populates="section")
 
 class Page(Base):
@@ -121,6 +122,61 @@ class Note(Base):
     content = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class NoteCache(Base):
+    # base model notes shared by every student without a personal adapter
+    __tablename__ = "note_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True, nullable=False)
+    model = Column(String)
+    content = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class LLMResponseCache(Base):
+    # responses from the Groq API keyed by a hash of model, messages and temperature
+    __tablename__ = "llm_response_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True, nullable=False)
+    model = Column(String)
+    response = Column(String, nullable=False)
+    size = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class ExtractedTextCache(Base):
+    # text per page of uploaded PDFs, keyed by a hash of the file and the extractor version
+    __tablename__ = "extracted_text_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True, nullable=False)
+    pages = Column(JSON, nullable=False)
+    size = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class LLMCall(Base):
+    # one row per LLM call, Groq or the local model, for latency and cost tracking
+    __tablename__ = "llm_calls"
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String, index=True)  # "groq" or "local"
+    model = Column(String)
+    kind = Column(String)  # what the call was for, e.g. "page", "quiz", "initial_notes"
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    # seconds waiting for a rate limit or worker slot, to the first token and in total
+    queue_wait = Column(Float, nullable=True)
+    time_to_first_token = Column(Float, nullable=True)
+    latency = Column(Float, nullable=True)
+    attempts = Column(Integer, default=1)
+    outcome = Column(String, index=True)  # "ok", "cached" or "error"
+    error = Column(String, nullable=True)
+    cost = Column(Float, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
 class Feedback(Base):
     __tablename__ = "feedbacks"
 
@@ -188,3 +244,26 @@ class QuizResult(Base):
     # relationships
     quiz = relationship("Quiz", back_populates="results")
     student = relationship("User", back_populates="quiz_results")
+
+class TrainingJobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class TrainingJob(Base):
+    __tablename__ = "training_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("users.id"), index=True)
+    status = Column(String, default=TrainingJobStatus.QUEUED, index=True)
+    # likes folded into this job while it was queued
+    requested_count = Column(Integer, default=1)
+    feedback_count = Column(Integer, nullable=True)
+    # newest feedback trained into the adapter by this job
+    last_feedback_id = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_requested_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import json
+
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+from database import SessionLocal
+from inference import inference
+from models import NoteCache, Page
+from utils.telemetry import current_course_id
+
+# everything besides the page content that decides what the base model writes,
+# bump "prompt" when initial_note_prompt or the decoded output changes
+GENERATION_CONFIG = {
+    "prompt": "initial_note_v2",
+    "max_new_tokens": Config.DEFAULT_MAX_TOKENS,
+}
+
+# keys being generated right now, so concurrent enrollments share the work
+_inflight = {}
+
+def note_cache_key(page_content, model_name=Config.MODEL_NAME, generation_config=GENERATION_CONFIG):
+    content_hash = hashlib.sha256(page_content.encode()).hexdigest()
+    config = json.dumps(generation_config, sort_keys=True)
+    return hashlib.sha256(f"{content_hash}:{model_name}:{config}".encode()).hexdigest()
+
+async def base_notes(db, page_contents):
+    """
+    Base model notes for the given pages, in order. Notes are looked up by
+    content hash and only pages never seen before are generated.
+    """
+    keys = [note_cache_key(content) for content in page_contents]
+    cached = {
+        row.key: row.content
+        for row in db.query(NoteCache).filter(NoteCache.key.in_(set(keys))).all()
+    }
+
+    # generate each missing page once, even if it appears twice or another
+    # request is already generating it
+    waiting = {}
+    to_generate = {}
+    for key, content in zip(keys, page_contents):
+        if key in cached or key in waiting or key in to_generate:
+            continue
+        if key in _inflight:
+            waiting[key] = _inflight[key]
+        else:
+            to_generate[key] = content
+
+    if to_generate:
+        loop = asyncio.get_running_loop()
+        futures = {key: loop.create_future() for key in to_generate}
+        _inflight.update(futures)
+        # small jobs, so a failure or timeout only loses its own pages and
+        # every finished group is cached right away
+        items = list(to_generate.items())
+        groups = [dict(items[i:i + Config.NOTE_JOB_PAGES]) for i in range(0, len(items), Config.NOTE_JOB_PAGES)]
+
+        # bounded so a big course doesn't fill the inference queue by itself
+        slots = asyncio.Semaphore(Config.NOTE_JOBS_IN_FLIGHT)
+
+        async def generate(group):
+            async with slots:
+                notes = await inference.submit("initial_notes", None, list(group.values()))
+            for key, note in zip(group, notes):
+                cached[key] = note
+                futures[key].set_result(note)
+                db.add(NoteCache(key=key, model=Config.MODEL_NAME, content=note))
+            try:
+                db.commit()
+            except IntegrityError:
+                # stored by another worker in the meantime, ours is just as good
+                db.rollback()
+
+        try:
+            results = await asyncio.gather(*(generate(group) for group in groups), return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+        except BaseException as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # waiters may have been cancelled, don't warn about it
+                    future.exception()
+            raise
+        finally:
+            for key in futures:
+                _inflight.pop(key, None)
+
+    for key, future in waiting.items():
+        cached[key] = await future
+
+    return [cached[key] for key in keys]
+
+async def precompute_course_notes(course_id):
+    """
+    Fills the cache for every page of a course so enrolling is a lookup.
+    """
+    current_course_id.set(course_id)
+    db = SessionLocal()
+    try:
+        pages = db.query(Page).filter(Page.course_id == course_id).order_by(Page.section_id, Page.order).all()
+        if pages:
+            await base_notes(db, [page.content for page in pages])
+    except Exception as e:
+        print(f"Failed to precompute notes for course {course_id}: {e}")
+    finally:
+        db.close()
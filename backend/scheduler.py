@@ -0,0 +1,321 @@
+import queue
+import threading
+import time
+
+import torch
+from transformers import DynamicCache
+
+from config import Config
+
+class GenerationRequest:
+    """
+    One submitted job: several prompts from the same user. The callback is
+    called once with all outputs (in prompt order) or with an error, plus the
+    job's metrics. When on_token is given it receives (prompt index, new text)
+    as tokens decode.
+    """
+    def __init__(self, user_id, prompts, callback, deadline=None, on_token=None, submitted_at=None):
+        self.user_id = user_id
+        self.prompts = prompts
+        self.callback = callback
+        self.deadline = deadline
+        self.on_token = on_token
+        self.outputs = [None] * len(prompts)
+        self.remaining = len(prompts)
+        self.failed = False
+        # wall clock times, submitted_at may come from another process
+        self.submitted_at = submitted_at or time.time()
+        self.started_at = None
+        self.first_token_at = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def metrics(self):
+        return {
+            "queue_wait": (self.started_at or time.time()) - self.submitted_at,
+            "time_to_first_token": self.first_token_at - self.submitted_at if self.first_token_at else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+    def finish(self, index, text, generated_tokens):
+        self.outputs[index] = text
+        self.completion_tokens += generated_tokens
+        self.remaining -= 1
+        if self.remaining == 0 and not self.failed:
+            self.callback(self.outputs, None, self.metrics())
+
+    def fail(self, error):
+        if not self.failed:
+            self.failed = True
+            self.callback(None, error, self.metrics())
+
+class Sequence:
+    def __init__(self, request, index, prompt_ids, adapter):
+        self.request = request
+        self.index = index
+        self.prompt_ids = prompt_ids
+        self.adapter = adapter
+        self.generated = []
+        self.streamed = 0  # characters of generated text already sent to on_token
+
+def length_buckets(lengths, batch_size=Config.GENERATION_BATCH_SIZE, max_batch_tokens=Config.GENERATION_BATCH_TOKENS):
+    """
+    Groups item indices into micro-batches of similar length so little of
+    each batch is padding. A batch is closed when it has batch_size items or
+    when padding everything to its longest item would exceed max_batch_tokens.
+    """
+    batches = []
+    batch = []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # sorted ascending, so the current item is the longest in the batch
+        if batch and (len(batch) >= batch_size or (len(batch) + 1) * lengths[i] > max_batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+class ContinuousBatchScheduler:
+    """
+    Continuous batching over the shared model. Prompts from any user are
+    admitted into the running decode batch between steps (their KV caches are
+    left-padded and concatenated onto the running one) and each sequence is
+    retired as soon as it hits EOS or max_new_tokens, so short notes don't
+    wait on long ones and new requests don't wait for the batch to drain.
+    Rows of different users run in the same forward pass through peft's
+    per-row adapter_names.
+    """
+    def __init__(self, registry, max_batch_size=Config.SCHEDULER_MAX_BATCH, max_new_tokens=Config.DEFAULT_MAX_TOKENS):
+        self.registry = registry
+        self.max_batch_size = max_batch_size
+        self.max_new_tokens = max_new_tokens
+        self.steps = 0
+        self.tokens_generated = 0
+        self.sequences_finished = 0
+
+        self._waiting = queue.Queue()
+        self._active = []
+        self._past = None  # legacy cache: per layer (keys, values), [batch, heads, seq, dim]
+        self._mask = None  # [batch, seq]
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, prompts, callback, deadline=None, on_token=None, submitted_at=None):
+        request = GenerationRequest(user_id, prompts, callback, deadline, on_token, submitted_at)
+        if not prompts:
+            callback([], None, request.metrics())
+            return
+        for index, prompt in enumerate(prompts):
+            self._waiting.put((request, index, prompt))
+
+    def _run(self):
+        while True:
+            # block while idle, otherwise only take what is already waiting
+            first = None if self._active else self._waiting.get()
+            try:
+                with self.registry.lock:
+                    self._admit(first)
+                    if self._active:
+                        self._decode_step()
+            except Exception as e:
+                print(f"Generation batch failed: {e}")
+                for seq in self._active:
+                    seq.request.fail(f"{type(e).__name__}: {e}")
+                self._active, self._past, self._mask = [], None, None
+
+    def _admit(self, first=None):
+        new = []
+        while len(self._active) + len(new) < self.max_batch_size:
+            if first is not None:
+                (request, index, prompt), first = first, None
+            else:
+                try:
+                    request, index, prompt = self._waiting.get_nowait()
+                except queue.Empty:
+                    break
+            if request.failed:
+                continue
+            if request.deadline is not None and time.time() > request.deadline:
+                request.fail("Job expired before it was started")
+                continue
+            new.append((request, index, prompt))
+        if not new:
+            return
+        try:
+            self._start(new)
+        except Exception as e:
+            # these are off the waiting queue but maybe not in the running
+            # batch, which is all _run fails, so they get the error here
+            for request, _, _ in new:
+                request.fail(f"{type(e).__name__}: {e}")
+            raise
+
+    def _start(self, new):
+        model, tokenizer = self.registry.batch_model()
+        pinned = {seq.adapter for seq in self._active}
+        sequences = []
+        for request, index, prompt in new:
+            try:
+                adapter = self.registry.batch_adapter(request.user_id, pinned=pinned)
+            except Exception as e:
+                request.fail(f"Could not load adapter: {e}")
+                continue
+            if request.failed:
+                continue
+            pinned.add(adapter)
+            prompt_ids = tokenizer(prompt)["input_ids"]
+            request.started_at = request.started_at or time.time()
+            request.prompt_tokens += len(prompt_ids)
+            sequences.append(Sequence(request, index, prompt_ids, adapter))
+        # prefill in length buckets so short prompts aren't padded to the longest one
+        for bucket in length_buckets([len(seq.prompt_ids) for seq in sequences]):
+            self._prefill([sequences[i] for i in bucket])
+
+    def _forward(self, sequences, input_ids, mask, past):
+        model, _ = self.registry.batch_model()
+        position_ids = mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(mask == 0, 1)
+        kwargs = {}
+        if hasattr(model, "peft_config"):
+            kwargs["adapter_names"] = [seq.adapter for seq in sequences]
+        with torch.no_grad():
+            out = model(
+                input_ids=input_ids.to(model.device),
+                attention_mask=mask.to(model.device),
+                position_ids=position_ids[:, -input_ids.shape[1]:].to(model.device),
+                past_key_values=DynamicCache.from_legacy_cache(past) if past is not None else None,
+                use_cache=True,
+                **kwargs
+            )
+        new_past = out.past_key_values
+        if isinstance(new_past, DynamicCache):
+            new_past = new_past.to_legacy_cache()
+        return out.logits[:, -1, :], new_past
+
+    def _prefill(self, sequences):
+        _, tokenizer = self.registry.batch_model()
+        width = max(len(seq.prompt_ids) for seq in sequences)
+        input_ids = torch.full((len(sequences), width), tokenizer.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(sequences), width), dtype=torch.long)
+        for row, seq in enumerate(sequences):
+            input_ids[row, width - len(seq.prompt_ids):] = torch.tensor(seq.prompt_ids)
+            mask[row, width - len(seq.prompt_ids):] = 1
+
+        logits, past = self._forward(sequences, input_ids, mask, None)
+        self._merge(sequences, past, mask)
+        self._append_tokens(sequences, logits)
+
+    def _merge(self, sequences, past, mask):
+        if not self._active:
+            self._active, self._past, self._mask = list(sequences), past, mask
+            return
+        width = max(self._mask.shape[1], mask.shape[1])
+        running_past, running_mask = _left_pad(self._past, self._mask, width)
+        new_past, new_mask = _left_pad(past, mask, width)
+        self._past = tuple(
+            (torch.cat([rk, nk.to(rk.device)]), torch.cat([rv, nv.to(rv.device)]))
+            for (rk, rv), (nk, nv) in zip(running_past, new_past)
+        )
+        self._mask = torch.cat([running_mask, new_mask])
+        self._active.extend(sequences)
+
+    def _decode_step(self):
+        # sequences that just finished during prefill are retired before stepping
+        self._retire()
+        if not self._active:
+            return
+        input_ids = torch.tensor([[seq.generated[-1]] for seq in self._active], dtype=torch.long)
+        self._mask = torch.cat([self._mask, torch.ones((len(self._active), 1), dtype=torch.long)], dim=1)
+        logits, self._past = self._forward(self._active, input_ids, self._mask, self._past)
+        self.steps += 1
+        self._append_tokens(self._active, logits)
+        self._retire()
+
+    def _append_tokens(self, sequences, logits):
+        model, _ = self.registry.batch_model()
+        next_tokens = _sample(logits, model.generation_config)
+        now = time.time()
+        for seq, token in zip(sequences, next_tokens.tolist()):
+            seq.generated.append(token)
+            seq.request.first_token_at = seq.request.first_token_at or now
+            if seq.request.on_token is not None:
+                self._stream(seq)
+        self.tokens_generated += len(sequences)
+
+    def _stream(self, seq):
+        _, tokenizer = self.registry.batch_model()
+        text = tokenizer.decode(seq.generated, skip_special_tokens=True)
+        # hold back incomplete multi-byte characters until the next token
+        if text.endswith("\ufffd"):
+            return
+        if len(text) > seq.streamed:
+            seq.request.on_token(seq.index, text[seq.streamed:])
+            seq.streamed = len(text)
+
+    def _retire(self):
+        model, tokenizer = self.registry.batch_model()
+        eos = model.generation_config.eos_token_id
+        eos = set(eos if isinstance(eos, list) else [eos])
+        keep = []
+        for row, seq in enumerate(self._active):
+            finished = seq.generated and (seq.generated[-1] in eos or len(seq.generated) >= self.max_new_tokens)
+            if seq.request.failed:
+                continue
+            if finished:
+                self.sequences_finished += 1
+                # only the generated text, the same text the streamed tokens add up to
+                seq.request.finish(seq.index, tokenizer.decode(seq.generated, skip_special_tokens=True), len(seq.generated))
+            else:
+                keep.append(row)
+
+        if len(keep) == len(self._active):
+            return
+        if not keep:
+            self._active, self._past, self._mask = [], None, None
+            return
+        index = torch.tensor(keep, dtype=torch.long)
+        self._active = [self._active[row] for row in keep]
+        self._mask = self._mask[index]
+        self._past = tuple((k[index.to(k.device)], v[index.to(v.device)]) for k, v in self._past)
+        # drop columns that are padding for every remaining row
+        first = int((self._mask.sum(0) > 0).nonzero()[0])
+        if first > 0:
+            self._mask = self._mask[:, first:]
+            self._past = tuple((k[:, :, first:], v[:, :, first:]) for k, v in self._past)
+
+    def status(self):
+        return {
+            "active": len(self._active),
+            "waiting": self._waiting.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "steps": self.steps,
+            "tokens_generated": self.tokens_generated,
+            "sequences_finished": self.sequences_finished,
+        }
+
+def _left_pad(past, mask, width):
+    pad = width - mask.shape[1]
+    if pad == 0:
+        return past, mask
+    mask = torch.cat([torch.zeros((mask.shape[0], pad), dtype=mask.dtype), mask], dim=1)
+    padded = []
+    for k, v in past:
+        shape = (k.shape[0], k.shape[1], pad, k.shape[3])
+        padded.append((torch.cat([k.new_zeros(shape), k], dim=2), torch.cat([v.new_zeros(shape), v], dim=2)))
+    return tuple(padded), mask
+
+def _sample(logits, generation_config):
+    # follows the model's own generation config like generate() does
+    if not generation_config.do_sample:
+        return logits.argmax(dim=-1)
+    logits = logits.float() / max(generation_config.temperature or 1.0, 1e-5)
+    probs = torch.softmax(logits, dim=-1)
+    top_p = generation_config.top_p
+    if top_p is not None and top_p < 1.0:
+        sorted_probs, sorted_idx = probs.sort(dim=-1, descending=True)
+        cumulative = sorted_probs.cumsum(dim=-1)
+        sorted_probs[cumulative - sorted_probs > top_p] = 0
+        probs = torch.zeros_like(probs).scatter(-1, sorted_idx, sorted_probs)
+    return torch.multinomial(probs, 1).squeeze(-1)
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from scheduler import ContinuousBatchScheduler
+
+class FakeTokenizer:
+    pad_token_id = 0
+
+    def __call__(self, text):
+        return {"input_ids": [1] * len(text.split())}
+
+class FakeRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def batch_model(self):
+        return object(), FakeTokenizer()
+
+    def batch_adapter(self, user_id, pinned=()):
+        return "default"
+
+def test_failed_prefill_fails_every_admitted_request(monkeypatch):
+    def forward(self, sequences, input_ids, mask, past):
+        raise RuntimeError("CUDA out of memory")
+
+    monkeypatch.setattr(ContinuousBatchScheduler, "_forward", forward)
+    registry = FakeRegistry()
+    scheduler = ContinuousBatchScheduler(registry, max_batch_size=16)
+
+    results = {}
+    done = threading.Event()
+    jobs = {
+        # lengths far apart so they are prefilled in separate buckets
+        "short": ["word " * n for n in range(1, 9)],
+        "long": ["word " * (n * 500) for n in range(1, 5)],
+    }
+
+    def callback(name):
+        def reply(outputs, error, metrics):
+            results[name] = error
+            if len(results) == len(jobs):
+                done.set()
+        return reply
+
+    # holding the lock makes the scheduler admit everything in one go, so the
+    # long prompts are still waiting for their bucket when the first one fails
+    with registry.lock:
+        for name, prompts in jobs.items():
+            scheduler.submit(None, prompts, callback(name))
+
+    assert done.wait(5), f"callbacks missing for {set(jobs) - set(results)}"
+    assert all("CUDA out of memory" in error for error in results.values())
@@ -0,0 +1,181 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import models
+from config import Config
+from database import SessionLocal
+from inference import inference
+from models import TrainingJob, TrainingJobStatus
+from utils.telemetry import current_user_id
+
+def last_trained_feedback_id(db, student_id):
+    """
+    Highest feedback id already trained into the student's adapter.
+    """
+    job = db.query(TrainingJob).filter(
+        TrainingJob.student_id == student_id,
+        TrainingJob.status == TrainingJobStatus.COMPLETED,
+        TrainingJob.last_feedback_id.isnot(None)
+    ).order_by(TrainingJob.last_feedback_id.desc()).first()
+    return job.last_feedback_id if job else None
+
+def build_training_data(db, student_id, after_feedback_id=None):
+    """
+    Formats the student's feedback for fine tuning, only feedback newer than
+    after_feedback_id when given. Returns the examples and the highest
+    feedback id they cover.
+    """
+    query = db.query(models.Feedback).filter(models.Feedback.student_id == student_id)
+    if after_feedback_id is not None:
+        query = query.filter(models.Feedback.id > after_feedback_id)
+    feedbacks = query.order_by(models.Feedback.id).all()
+
+    data = []
+    last_feedback_id = None
+    for feedback in feedbacks:
+        last_feedback_id = feedback.id
+        note = db.query(models.Note).filter(models.Note.id == feedback.note_id).first()
+        if note is None:
+            continue
+        page = db.query(models.Page).filter(models.Page.id == note.page_id).first()
+        if page is None:
+            continue
+        data.append({
+            "input": f"Generate notes for the given content: {page.content}",
+            "output": note.content,
+            "feedback": "like" if feedback.like is not None and feedback.like == True else "dislike"
+        })
+    return data, last_feedback_id
+
+class TrainingQueue:
+    """
+    Runs liked-feedback fine tuning in the background. Likes from the same
+    student are coalesced into one queued job that starts once no new like has
+    arrived for `debounce` seconds, a student never has two trainings running
+    and at most `max_concurrent` run at once. Job state lives in the
+    training_jobs table so queued work survives a restart.
+    """
+    def __init__(self, debounce=Config.TRAINING_DEBOUNCE_SECONDS, max_concurrent=Config.MAX_CONCURRENT_TRAININGS):
+        self.debounce = debounce
+        self.max_concurrent = max_concurrent
+        self._running = set()  # student ids with a job in progress
+        self._dispatcher = None
+        self._tasks = set()  # running jobs, the loop only keeps weak references to tasks
+
+    def start(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._wakeup = asyncio.Event()
+
+        # jobs that were running when the server stopped are started over
+        db = SessionLocal()
+        try:
+            db.query(TrainingJob).filter(
+                TrainingJob.status == TrainingJobStatus.RUNNING
+            ).update({"status": TrainingJobStatus.QUEUED, "started_at": None})
+            db.commit()
+        finally:
+            db.close()
+
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for task in self._tasks:
+            task.cancel()
+
+    def request(self, db, student_id):
+        """
+        Records a training request for the student, folding it into their
+        queued job when there is one.
+        """
+        now = datetime.utcnow()
+        job = db.query(TrainingJob).filter(
+            TrainingJob.student_id == student_id,
+            TrainingJob.status == TrainingJobStatus.QUEUED
+        ).first()
+        if job:
+            job.requested_count += 1
+            job.last_requested_at = now
+        else:
+            job = TrainingJob(student_id=student_id, last_requested_at=now)
+            db.add(job)
+        db.commit()
+        db.refresh(job)
+        self._wakeup.set()
+        return job
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            next_due = None
+            db = SessionLocal()
+            try:
+                queued = db.query(TrainingJob).filter(
+                    TrainingJob.status == TrainingJobStatus.QUEUED
+                ).order_by(TrainingJob.last_requested_at).all()
+                now = datetime.utcnow()
+                for job in queued:
+                    if job.student_id in self._running:
+                        continue
+                    due = job.last_requested_at + timedelta(seconds=self.debounce)
+                    if due <= now:
+                        self._running.add(job.student_id)
+                        task = asyncio.create_task(self._run(job.id, job.student_id))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._task_done)
+                    elif next_due is None or due < next_due:
+                        next_due = due
+            finally:
+                db.close()
+
+            timeout = (next_due - datetime.utcnow()).total_seconds() if next_due else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0) if timeout is not None else None)
+            except asyncio.TimeoutError:
+                pass
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Training job task failed: {task.exception()}")
+
+    async def _run(self, job_id, student_id):
+        current_user_id.set(student_id)
+        try:
+            async with self._semaphore:
+                db = SessionLocal()
+                try:
+                    job = db.query(TrainingJob).filter(TrainingJob.id == job_id).first()
+                    job.status = TrainingJobStatus.RUNNING
+                    job.started_at = datetime.utcnow()
+                    db.commit()
+
+                    # built now so likes that came in while waiting are included,
+                    # training resumes from the current adapter so only new feedback is needed
+                    data, last_feedback_id = build_training_data(
+                        db, student_id, last_trained_feedback_id(db, student_id)
+                    )
+                    job.feedback_count = len(data)
+                    db.commit()
+                    try:
+                        if data:
+                            await inference.submit("fine_tune", student_id, data, timeout=Config.FINE_TUNE_TIMEOUT)
+                        job.last_feedback_id = last_feedback_id
+                        job.status = TrainingJobStatus.COMPLETED
+                    except Exception as e:
+                        print(f"Training job {job_id} failed: {e}")
+                        job.status = TrainingJobStatus.FAILED
+                        job.error = str(e) or type(e).__name__
+                    job.finished_at = datetime.utcnow()
+                    db.commit()
+                finally:
+                    db.close()
+        finally:
+            self._running.discard(student_id)
+            # a like may have queued another job for this student meanwhile
+            self._wakeup.set()
+
+# shared instance used by the API handlers
+training_queue = TrainingQueue()
@@ -0,0 +1,75 @@
+import re
+
+def _tokens_for_length(length: int) -> int:
+    # rough count for budgeting, ~4 characters per token for English
+    return length // 4 + 1
+
+def estimate_tokens(text: str) -> int:
+    return _tokens_for_length(len(text))
+
+def _split(text: str, max_tokens: int) -> list[str]:
+    # paragraphs, then sentences, then words, whichever is small enough
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            if estimate_tokens(sentence) <= max_tokens:
+                pieces.append(sentence)
+            else:
+                pieces.extend(_split_words(sentence, max_tokens))
+    return pieces
+
+def _split_words(sentence: str, max_tokens: int) -> list[str]:
+    # words are measured as they are added, a word too long on its own
+    # (a formula, a URL, text without spaces) is cut by characters
+    max_chars = max(1, max_tokens * 4 - 1)  # the longest text estimate_tokens keeps within max_tokens
+    pieces = []
+    current = ""
+    for word in sentence.split():
+        while len(word) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(word[:max_chars])
+            word = word[max_chars:]
+        if current and _tokens_for_length(len(current) + 1 + len(word)) > max_tokens:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+def chunk_text(text: str, max_tokens: int, overlap_tokens: int = 0) -> list[str]:
+    """
+    Splits text into chunks of at most max_tokens (estimated), breaking at
+    paragraph or sentence boundaries where possible. With overlap_tokens the
+    last pieces of each chunk are repeated at the start of the next one.
+    """
+    chunks = []
+    current = []
+    current_length = 0  # characters of the current pieces joined
+    for piece in _split(text, max_tokens):
+        if current and _tokens_for_length(current_length + 2 + len(piece)) > max_tokens:
+            chunks.append("\n\n".join(current))
+            # carry the tail over, as long as it leaves room for the new piece
+            carried = []
+            carried_length = 0
+            for previous in reversed(current):
+                length = carried_length + len(previous) + (2 if carried else 0)
+                if _tokens_for_length(length) > overlap_tokens or _tokens_for_length(length + 2 + len(piece)) > max_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_length = length
+            current, current_length = carried, carried_length
+        current_length += len(piece) + (2 if current else 0)
+        current.append(piece)
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal
+from models import ExtractedTextCache
+
+# how big the cache may grow, in bytes of UTF-8 encoded text
+EXTRACT_CACHE_MAX_BYTES = int(os.getenv("EXTRACT_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+EXTRACT_CACHE_ENABLED = os.getenv("EXTRACT_CACHE_ENABLED", "true").lower() == "true"
+
+# running size of the cache, so a put doesn't sum the whole table. It is
+# read from the database again every _RESYNC_EVERY puts to pick up entries
+# written by other server processes
+_RESYNC_EVERY = 100
+_size_lock = threading.Lock()
+_total_size = None
+_puts = 0
+
+def _get(key: str):
+    db = SessionLocal()
+    try:
+        row = db.query(ExtractedTextCache).filter(ExtractedTextCache.key == key).first()
+        if row is None:
+            return None
+        row.last_used_at = datetime.utcnow()
+        db.commit()
+        return row.pages
+    finally:
+        db.close()
+
+def _put(key: str, pages: list[str]):
+    global _total_size, _puts
+    size = sum(len(page.encode()) for page in pages)
+    db = SessionLocal()
+    try:
+        db.add(ExtractedTextCache(
+            key=key,
+            pages=pages,
+            size=size
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            # stored by a concurrent upload of the same file
+            db.rollback()
+            return
+
+        with _size_lock:
+            _puts += 1
+            if _total_size is None or _puts % _RESYNC_EVERY == 0:
+                _total_size = db.query(func.coalesce(func.sum(ExtractedTextCache.size), 0)).scalar()
+            else:
+                _total_size += size
+            total = _total_size
+
+        # evict least recently used entries until we are under the size limit
+        if total > EXTRACT_CACHE_MAX_BYTES:
+            evict = []
+            entries = db.query(ExtractedTextCache.id, ExtractedTextCache.size).order_by(ExtractedTextCache.last_used_at)
+            for entry_id, entry_size in entries:
+                if total <= EXTRACT_CACHE_MAX_BYTES:
+                    break
+                total -= entry_size or 0
+                evict.append(entry_id)
+            db.query(ExtractedTextCache).filter(ExtractedTextCache.id.in_(evict)).delete(synchronize_session=False)
+            db.commit()
+            with _size_lock:
+                _total_size = total
+    finally:
+        db.close()
+
+async def get_cached_pages(key: str):
+    if not EXTRACT_CACHE_ENABLED:
+        return None
+    return await asyncio.to_thread(_get, key)
+
+async def put_cached_pages(key: str, pages: list[str]):
+    if EXTRACT_CACHE_ENABLED:
+        await asyncio.to_thread(_put, key, pages)
@@ -5,13 +5,206 @@ import os
 import aiohttp
 import asyncio
 import json
-import re
-from pathlib import Path
+import time
+from .chunking import chunk_text, estimate_tokens
+from .llm_cache import cache_key, get_cached, put_cached
+from .structured import QUIZ_SCHEMA, COURSE_DETAILS_SCHEMA, StructuredOutputError, parse_structured, repair_messages
+from .telemetry import record_llm_call
+from .rate_limiter import RateLimiter, PRIORITY_INTERACTIVE, PRIORITY_BULK, parse_duration, backoff_delay
 
 GROK_API_KEY = os.getenv("GROK_API_KEY")
-GROK_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+# override to point at a local stand-in server
+GROK_API_URL = os.getenv("GROK_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+# max open connections to the API, and per-call timeouts in seconds
+GROK_POOL_SIZE = int(os.getenv("GROK_POOL_SIZE", "20"))
+GROK_TIMEOUT = float(os.getenv("GROK_TIMEOUT", "120"))
+GROK_CONNECT_TIMEOUT = float(os.getenv("GROK_CONNECT_TIMEOUT", "10"))
 
-async def query_grok(content: str) -> str:  
+# client side limits, set a bit under the account's limits
+GROK_REQUESTS_PER_MINUTE = int(os.getenv("GROK_REQUESTS_PER_MINUTE", "30"))
+GROK_TOKENS_PER_MINUTE = int(os.getenv("GROK_TOKENS_PER_MINUTE", "30000"))
+GROK_MAX_RETRIES = int(os.getenv("GROK_MAX_RETRIES", "5"))
+# completion length reserved per call until real usage has been seen
+GROK_EXPECTED_COMPLETION_TOKENS = int(os.getenv("GROK_EXPECTED_COMPLETION_TOKENS", "1024"))
+# repair prompts sent for a reply that doesn't match its schema
+GROK_MAX_REPAIRS = int(os.getenv("GROK_MAX_REPAIRS", "1"))
+
+# large uploads are summarized down to this many tokens before they go into
+# the quiz and course details prompts, in chunks of SUMMARY_CHUNK_TOKENS
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "3000"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "6"))
+
+rate_limiter = RateLimiter(GROK_REQUESTS_PER_MINUTE, GROK_TOKENS_PER_MINUTE, GROK_EXPECTED_COMPLETION_TOKENS)
+
+# one pooled session for the whole app so connections, TLS sessions and DNS
+# lookups are reused between calls
+_session = None
+
+async def start_client() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=GROK_POOL_SIZE, ttl_dns_cache=300, keepalive_timeout=60)
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            headers={
+                "Authorization": f"Bearer {GROK_API_KEY}",
+                "Content-Type": "application/json"
+            }
+        )
+    return _session
+
+async def close_client():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+class GrokAPIError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Failed to query GROK API ({status}): {message}")
+        self.status = status
+
+async def chat_completion(messages: list[dict], model: str, temperature: float = 0.7, max_tokens: int = 4096, timeout: float = GROK_TIMEOUT, priority: int = PRIORITY_INTERACTIVE, refresh: bool = False, on_progress=None, kind: str = "chat") -> str:
+    """
+    on_progress, when given, makes this a streamed completion and is called
+    with (text so far, tokens so far) as chunks arrive. Every call is
+    recorded in the llm_calls table under kind.
+    """
+    started = time.monotonic()
+    prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+
+    # identical prompts are answered from the cache, refresh forces a new
+    # completion (which then replaces the cached one)
+    key = cache_key(model, messages, temperature)
+    if not refresh:
+        cached = await get_cached(key)
+        if cached is not None:
+            if on_progress is not None:
+                await on_progress(cached, estimate_tokens(cached))
+            await record_llm_call(
+                "groq", model, kind, "cached",
+                prompt_tokens=prompt_tokens,
+                completion_tokens=estimate_tokens(cached),
+                latency=time.monotonic() - started
+            )
+            return cached
+
+    call = {"queue_wait": 0, "attempts": 0, "usage": {}}
+    try:
+        response_content = await _post_completion(messages, model, temperature, max_tokens, timeout, priority, on_progress, call)
+    except Exception as e:
+        await record_llm_call(
+            "groq", model, kind, "error",
+            prompt_tokens=prompt_tokens,
+            queue_wait=call["queue_wait"],
+            latency=time.monotonic() - started,
+            attempts=call["attempts"],
+            error=str(e)[:500]
+        )
+        raise
+    usage = call["usage"]
+    await record_llm_call(
+        "groq", model, kind, "ok",
+        prompt_tokens=usage.get("prompt_tokens", prompt_tokens),
+        completion_tokens=usage.get("completion_tokens", estimate_tokens(response_content)),
+        queue_wait=call["queue_wait"],
+        time_to_first_token=call.get("first_token_at", time.monotonic()) - started,
+        latency=time.monotonic() - started,
+        attempts=call["attempts"]
+    )
+    await put_cached(key, model, response_content)
+    return response_content
+
+async def _read_stream(response, on_progress, call: dict) -> tuple[str, dict]:
+    # server-sent events, one "data: {json}" line per chunk and "data: [DONE]" at the end
+    parts = []
+    usage = {}
+    chunks = 0
+    async for line in response.content:
+        line = line.decode().strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        try:
+            chunk = json.loads(data)
+        except json.JSONDecodeError:
+            # a ClientError, so the attempt is retried like a dropped connection
+            raise aiohttp.ClientPayloadError(f"Malformed stream chunk: {data[:200]}")
+        # groq reports usage on the last chunk under x_groq
+        usage = chunk.get("usage") or chunk.get("x_groq", {}).get("usage") or usage
+        if not chunk.get("choices"):
+            continue
+        delta = chunk["choices"][0].get("delta", {}).get("content")
+        if delta:
+            call.setdefault("first_token_at", time.monotonic())
+            parts.append(delta)
+            chunks += 1
+            await on_progress("".join(parts), chunks)
+    return "".join(parts), usage
+
+async def _post_completion(messages: list[dict], model: str, temperature: float, max_tokens: int, timeout: float, priority: int, on_progress=None, call: dict = None) -> str:
+    # call collects queue wait, attempts, first token time and usage for telemetry
+    call = call if call is not None else {"queue_wait": 0, "attempts": 0, "usage": {}}
+    session = await start_client()
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": on_progress is not None
+    }
+    call_timeout = aiohttp.ClientTimeout(total=timeout, connect=GROK_CONNECT_TIMEOUT)
+    prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+
+    for attempt in range(GROK_MAX_RETRIES + 1):
+        # reserves the prompt plus a typical completion, settled against the
+        # real usage on success and refunded when the attempt fails
+        reserved = rate_limiter.reservation(prompt_tokens, max_tokens)
+        call["queue_wait"] += await rate_limiter.acquire(reserved, priority)
+        call["attempts"] += 1
+        retry_after = None
+        settled = False
+        try:
+            async with session.post(GROK_API_URL, json=payload, timeout=call_timeout) as response:
+                rate_limiter.update_from_headers(response.headers)
+                if response.status == 200:
+                    if on_progress is not None:
+                        response_content, usage = await _read_stream(response, on_progress, call)
+                    else:
+                        data = await response.json()
+                        response_content, usage = data['choices'][0]['message']['content'], data.get("usage", {})
+                    call["usage"] = usage
+                    completion_tokens = usage.get("completion_tokens", estimate_tokens(response_content))
+                    rate_limiter.settle(reserved, usage.get("total_tokens", prompt_tokens + completion_tokens), completion_tokens)
+                    settled = True
+                    return response_content
+
+                error_text = await response.text()
+                error = GrokAPIError(response.status, error_text)
+                if response.status == 429:
+                    retry_after = parse_duration(response.headers.get("retry-after"))
+                elif response.status < 500:
+                    # our request is wrong, retrying won't help
+                    raise error
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        finally:
+            if not settled:
+                rate_limiter.refund(reserved)
+
+        if attempt == GROK_MAX_RETRIES:
+            raise error
+        delay = retry_after or backoff_delay(attempt)
+        if retry_after:
+            # everyone else would get a 429 too
+            rate_limiter.pause(retry_after)
+        print(f"GROK API call failed ({error}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+async def query_grok(content: str, priority: int = PRIORITY_INTERACTIVE, refresh: bool = False, on_progress=None, kind: str = "page") -> str:
     messages = [
         {
             "role": "system",
@@ -101,39 +294,106 @@ async def query_grok(content: str) -> str:
     ]
     
     
-    payload = {
-        "model": "llama3-groq-8b-8192-tool-use-preview",
-        "messages": messages,
-        "temperature": 0.7,
-        "max_tokens": 4096
-    }
-    
-    headers = {
-        "Authorization": f"Bearer {GROK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.post(GROK_API_URL, headers=headers, json=payload) as response:
-            if response.status == 200:
-                data = await response.json()
-                response_content = data['choices'][0]['message']['content']
-                print("Response from GROK API:")
-                print(response_content)
-                return response_content
-            else:
-                error_text = await response.text()
-                raise Exception(f"Failed to query GROK API: {error_text}")
+    response_content = await chat_completion(
+        messages,
+        model="llama3-groq-8b-8192-tool-use-preview",
+        temperature=0.7,
+        max_tokens=4096,
+        priority=priority,
+        refresh=refresh,
+        on_progress=on_progress,
+        kind=kind
+    )
+    return response_content
 
 async def process_pdf_content(content: str) -> str:
     summary = await query_grok(content)
     return summary
 
-async def query_grok_quiz(content: str) -> str:
-    words = content.split()
-    max_words = 100  # ~10 pages
-    truncated_content = ' '.join(words[:max_words])
-    
+# summary calls in flight when the caller doesn't pass its own limit
+_summary_slots = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+
+async def _summarize_chunk(chunk: str, max_tokens: int, priority: int, refresh: bool, llm_slots: asyncio.Semaphore) -> str:
+    messages = [
+        {
+            "role": "system",
+            "content": f"""You condense course material for a teacher who will write quizzes and course descriptions from it.
+            Keep every definition, formula, theorem, key fact and worked result, drop repetition and filler.
+            Answer with the condensed material only, in at most {max(1, max_tokens * 3 // 4)} words."""
+        },
+        {
+            "role": "user",
+            "content": chunk
+        }
+    ]
+    async with llm_slots:
+        return await chat_completion(
+            messages,
+            model="llama3-groq-8b-8192-tool-use-preview",
+            temperature=0.3,
+            max_tokens=max_tokens,
+            priority=priority,
+            refresh=refresh,
+            kind="summary"
+        )
+
+def section_budget(section_count: int, budget: int = PROMPT_TOKEN_BUDGET) -> int:
+    """
+    Tokens each of section_count sections may be summarized to so that all
+    of them, with their titles, fit in budget together.
+    """
+    return max(64, budget // max(1, section_count) - 16)
+
+async def summarize_content(content: str, budget: int = PROMPT_TOKEN_BUDGET, priority: int = PRIORITY_BULK, refresh: bool = False, max_rounds: int = 3, llm_slots: asyncio.Semaphore = None) -> str:
+    """
+    Map-reduce summary of content that fits in budget tokens. Content that
+    already fits is returned unchanged, otherwise its chunks are summarized
+    concurrently and the joined summaries are reduced again until they fit.
+    Each summary call holds one of llm_slots, so a caller with its own limit
+    on LLM calls can pass it in.
+    """
+    llm_slots = llm_slots or _summary_slots
+    for _ in range(max_rounds):
+        if estimate_tokens(content) <= budget:
+            return content
+        chunks = chunk_text(content, SUMMARY_CHUNK_TOKENS)
+        # share the budget between the chunks so one round is usually enough
+        target = max(64, budget // len(chunks))
+        summaries = await asyncio.gather(*(
+            _summarize_chunk(chunk, target, priority, refresh, llm_slots) for chunk in chunks
+        ))
+        content = "\n\n".join(summaries)
+    if estimate_tokens(content) <= budget:
+        return content
+    # still too long after the last round, keep what fits
+    return chunk_text(content, budget)[0]
+
+async def parse_or_repair(text: str, schema, max_items: int = None, priority: int = PRIORITY_BULK, refresh: bool = False, max_repairs: int = GROK_MAX_REPAIRS):
+    """
+    Parses a structured reply against the schema. When it doesn't validate
+    only the broken JSON is sent back for repair, with a small prompt, up to
+    max_repairs times. Raises StructuredOutputError when it still fails.
+    """
+    for attempt in range(max_repairs + 1):
+        try:
+            return parse_structured(text, schema, max_items)
+        except StructuredOutputError as e:
+            if attempt == max_repairs:
+                raise
+            print(f"Structured reply invalid ({e}), asking for a repair")
+            messages = repair_messages(e.fragment, str(e), schema)
+            text = await chat_completion(
+                messages,
+                model="llama3-groq-70b-8192-tool-use-preview",
+                temperature=0,
+                max_tokens=min(4096, estimate_tokens(e.fragment) * 2 + 256),
+                priority=priority,
+                refresh=refresh,
+                kind="repair"
+            )
+
+async def query_grok_quiz(content: str, priority: int = PRIORITY_INTERACTIVE, refresh: bool = False) -> list:
+    # content is expected to fit the prompt budget, callers reduce it first
     messages = [
         {
             "role": "system",
@@ -164,81 +424,32 @@ async def query_grok_quiz(content: str) -> str:
         },
         {
             "role": "user",
-            "content": f"Generate ONE array of 4 quiz questions for this content:\n\n{truncated_content}"
+            "content": f"Generate ONE array of 4 quiz questions for this content:\n\n{content}"
         }
     ]
     
-    payload = {
-        "model": "llama3-groq-70b-8192-tool-use-preview",
-        "messages": messages,
-        "temperature": 0.7,  # lower temperature for more consistent output
-        "max_tokens": 4096   # reduced since quiz responses are shorter
-    }
-    
-    headers = {
-        "Authorization": f"Bearer {GROK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.post(GROK_API_URL, headers=headers, json=payload) as response:
-            if response.status == 200:
-                data = await response.json()
-                response_content = data['choices'][0]['message']['content']
-                print("Raw quiz response:", response_content)
-                
-                try:
-                    # Clean the response
-                    cleaned_content = re.sub(r'\s*//.*$', '', response_content, flags=re.MULTILINE)
-                    cleaned_content = re.sub(r',\s*([}\]])', r'\1', cleaned_content)
-                    
-                    # Parse JSON once
-                    questions = json.loads(cleaned_content)
-                    print(f"Parsed questions: {questions}")
-                    
-                    # Validate questions
-                    if not isinstance(questions, list):
-                        raise Exception("Response must be a list")
-                        
-                    cleaned_questions = []
-                    for i, q in enumerate(questions[:4]):
-                        print(f"Validating question {i + 1}")
-                        if not all(key in q for key in ['question', 'options', 'correctAnswer']):
-                            continue
-                            
-                        if not isinstance(q['options'], list):
-                            continue
-                            
-                        # Truncate options to 4 if needed
-                        if len(q['options']) > 4:
-                            correct_option = q['options'][q['correctAnswer']]
-                            q['options'] = q['options'][:4]
-                            if correct_option not in q['options']:
-                                q['options'][-1] = correct_option
-                            q['correctAnswer'] = q['options'].index(correct_option)
-                        elif len(q['options']) < 4:
-                            continue
-                            
-                        if not isinstance(q['correctAnswer'], int) or q['correctAnswer'] not in range(4):
-                            continue
-                            
-                        cleaned_questions.append(q)
-                    
-                    if not cleaned_questions:
-                        raise Exception("No valid questions found")
-                        
-                    # Return the cleaned questions directly
-                    return cleaned_questions[:4]
-                    
-                except json.JSONDecodeError as e:
-                    print(f"Failed to parse quiz JSON: {e}")
-                    print(f"Cleaned response: {cleaned_content}")
-                    raise Exception("Failed to parse quiz response")
-            else:
-                error_text = await response.text()
-                raise Exception(f"Failed to query GROK API: {error_text}")
+    response_content = await chat_completion(
+        messages,
+        model="llama3-groq-70b-8192-tool-use-preview",
+        temperature=0.7,  # lower temperature for more consistent output
+        max_tokens=4096,  # reduced since quiz responses are shorter
+        priority=priority,
+        refresh=refresh,
+        kind="quiz"
+    )
 
-async def generate_quiz(content: list[tuple[str, str]], progress_callback=None) -> list:
+    try:
+        # validated against the schema, a broken reply is repaired rather than regenerated
+        return await parse_or_repair(response_content, QUIZ_SCHEMA, max_items=4, priority=priority, refresh=refresh)
+    except StructuredOutputError as e:
+        print(f"Failed to parse quiz response: {e}")
+        raise Exception("Failed to parse quiz response")
+
+async def generate_quiz(content: list[tuple[str, str]], progress_callback=None, refresh: bool = False) -> list:
+    """
+    Quiz for the (title, content) sections, which the caller has already
+    reduced to fit the prompt budget (see summarize_content).
+    """
     try:
         if progress_callback:
             await anext(progress_callback({
@@ -247,17 +458,12 @@ async def generate_quiz(content: list[tuple[str, str]], progress_callback=None)
                 "stats": {"step": "Generating quiz questions"}
             }))
             
-        # take first 10 pages worth of content from each section
         quiz_content = ""
         for section_title, section_content in content:
-            words = section_content.split()
-            max_words = 5000  # ~10 pages
-            truncated_section = ' '.join(words[:max_words])
-            quiz_content += f"\n\n{section_title}:\n{truncated_section}"
+            quiz_content += f"\n\n{section_title}:\n{section_content}"
             
         # questions is already a parsed list, no need to parse again
-        questions = await query_grok_quiz(quiz_content)
-        print("Raw quiz response:", questions)  # debug print
+        questions = await query_grok_quiz(quiz_content, priority=PRIORITY_BULK, refresh=refresh)
         
         if progress_callback:
             await anext(progress_callback({
@@ -282,11 +488,20 @@ async def generate_quiz(content: list[tuple[str, str]], progress_callback=None)
             }))
         return []
 
-async def generate_course_details(title: str, content: str) -> dict:
+async def generate_course_details(title: str, content: str, priority: int = PRIORITY_BULK, refresh: bool = False, word_count: int = None) -> dict:
+    """
+    Course details from content the caller has already reduced to fit the
+    prompt budget. word_count is the size of the original material, the
+    fallback estimates difficulty and hours from it.
+    """
+    word_count = word_count if word_count is not None else len(content.split())
     try:
         prompt = f"""Analyze the course content and generate a detailed course description.
         Title: "{title}"
 
+        Course material:
+        {content}
+
         Return a JSON object exactly in this format (note the escaped newlines and quotes):
         {{
             "description": "# Course Title\\n\\nFirst paragraph introducing the course...\\n\\nSecond paragraph about main topics...\\n\\nThird paragraph about outcomes...",
@@ -326,29 +541,20 @@ async def generate_course_details(title: str, content: str) -> dict:
         7. Do not include any markdown code blocks or json keywords
         """
 
-        response = await query_grok(prompt)
+        response = await query_grok(prompt, priority=priority, refresh=refresh, kind="course_details")
         
         try:
-            # remove any markdown code blocks or extra formatting
-            cleaned_response = (response
-                .replace('```json', '')
-                .replace('```', '')
-                .strip())
-            
-            course_details = json.loads(cleaned_response)
-            return course_details
-        except json.JSONDecodeError as e:
+            return await parse_or_repair(response, COURSE_DETAILS_SCHEMA, priority=priority, refresh=refresh)
+        except StructuredOutputError as e:
             print(f"Failed to parse course details JSON: {e}")
-            print(f"Raw response: {response}")
-            return generate_fallback_response(title, content)
+            return generate_fallback_response(title, word_count)
             
     except Exception as e:
         print(f"Error generating course details: {e}")
-        return generate_fallback_response(title, content)
+        return generate_fallback_response(title, word_count)
 
-def generate_fallback_response(title: str, content: str) -> dict:
-    # create a more meaningful fallback using the title and content
-    word_count = len(content.split())
+def generate_fallback_response(title: str, word_count: int) -> dict:
+    # create a more meaningful fallback using the title and the material's size
     difficulty = "Advanced" if word_count > 5000 else "Intermediate" if word_count > 2000 else "Beginner"
     
     return {
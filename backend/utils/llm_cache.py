@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal
+from models import LLMResponseCache
+
+# how long a cached response stays valid and how big the cache may grow
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+
+# running size of the cache, so a put doesn't sum the whole table. It is
+# read from the database again every _RESYNC_EVERY puts to pick up entries
+# written by other server processes
+_RESYNC_EVERY = 100
+_size_lock = threading.Lock()
+_total_size = None
+_puts = 0
+
+def cache_key(model: str, messages: list[dict], temperature: float) -> str:
+    key = json.dumps({"model": model, "messages": messages, "temperature": temperature}, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def _get(key: str):
+    db = SessionLocal()
+    try:
+        row = db.query(LLMResponseCache).filter(LLMResponseCache.key == key).first()
+        if row is None:
+            return None
+        now = datetime.utcnow()
+        if row.created_at < now - timedelta(hours=LLM_CACHE_TTL_HOURS):
+            db.delete(row)
+            db.commit()
+            return None
+        row.last_used_at = now
+        db.commit()
+        return row.response
+    finally:
+        db.close()
+
+def _put(key: str, model: str, response: str):
+    global _total_size, _puts
+    size = len(response.encode())
+    db = SessionLocal()
+    try:
+        row = db.query(LLMResponseCache).filter(LLMResponseCache.key == key).first()
+        # a refreshed entry replaces the old response
+        replaced = 0
+        if row is None:
+            row = LLMResponseCache(key=key, model=model)
+            db.add(row)
+        else:
+            replaced = row.size or 0
+        row.response = response
+        row.size = size
+        row.created_at = row.last_used_at = datetime.utcnow()
+        try:
+            db.commit()
+        except IntegrityError:
+            # stored by a concurrent call with the same prompt
+            db.rollback()
+            return
+
+        with _size_lock:
+            _puts += 1
+            if _total_size is None or _puts % _RESYNC_EVERY == 0:
+                _total_size = db.query(func.coalesce(func.sum(LLMResponseCache.size), 0)).scalar()
+            else:
+                _total_size += size - replaced
+            total = _total_size
+
+        # evict least recently used entries until we are under the size limit
+        if total > LLM_CACHE_MAX_BYTES:
+            evict = []
+            entries = db.query(LLMResponseCache.id, LLMResponseCache.size).order_by(LLMResponseCache.last_used_at)
+            for entry_id, entry_size in entries:
+                if total <= LLM_CACHE_MAX_BYTES:
+                    break
+                total -= entry_size or 0
+                evict.append(entry_id)
+            db.query(LLMResponseCache).filter(LLMResponseCache.id.in_(evict)).delete(synchronize_session=False)
+            db.commit()
+            with _size_lock:
+                _total_size = total
+    finally:
+        db.close()
+
+async def get_cached(key: str):
+    if not LLM_CACHE_ENABLED:
+        return None
+    return await asyncio.to_thread(_get, key)
+
+async def put_cached(key: str, model: str, response: str):
+    if LLM_CACHE_ENABLED:
+        await asyncio.to_thread(_put, key, model, response)
@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing as mp
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import PyPDF2
+
+from .extract_cache import get_cached_pages, put_cached_pages
+
+# bump when extraction changes in a way that changes the text it returns
+EXTRACTOR_VERSION = 1
+
+# processes used for extraction. PDFs with at least PDF_SPLIT_MIN_PAGES pages
+# are split in page ranges extracted in parallel, at least PDF_PAGES_PER_TASK
+# pages each and about one per worker
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_SPLIT_MIN_PAGES = int(os.getenv("PDF_SPLIT_MIN_PAGES", "50"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+
+# limits for uploads, zip members are checked by what they really inflate to.
+# The PDFs of an upload are held in memory until extracted, so a request can
+# hold up to MAX_UNCOMPRESSED_BYTES (or MAX_PDF_BYTES for a single PDF)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(500 * 1024 * 1024)))
+MAX_ZIP_MEMBERS = int(os.getenv("MAX_ZIP_MEMBERS", "200"))
+MAX_PDF_BYTES = int(os.getenv("MAX_PDF_BYTES", str(200 * 1024 * 1024)))
+MAX_UNCOMPRESSED_BYTES = int(os.getenv("MAX_UNCOMPRESSED_BYTES", str(500 * 1024 * 1024)))
+
+_pool = None
+
+class UploadRejected(ValueError):
+    pass
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn like the inference workers, forking a threaded server is unsafe
+        _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=mp.get_context("spawn"))
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+class ExtractedPdf:
+    def __init__(self, name: str, pages: list[str], seconds: float, cached: bool = False):
+        self.name = name
+        self.pages = pages  # text per page, "" for pages without text
+        self.seconds = seconds
+        self.cached = cached
+
+    @property
+    def text(self) -> str:
+        return "".join(page + "\n\n" for page in self.pages if page)
+
+def _mb(size: int) -> int:
+    return size // (1024 * 1024)
+
+def _read_limited(stream, limit: int, name: str) -> bytes:
+    data = stream.read(limit + 1)
+    if len(data) > limit:
+        raise UploadRejected(f"{name} is larger than {_mb(limit)} MB")
+    return data
+
+def read_upload(fileobj, filename: str) -> list[tuple[str, bytes]]:
+    """
+    PDFs in an upload as (title, bytes), read straight from the (spooled)
+    upload file. A zip is read member by member without extracting anything
+    to disk. All PDFs are returned in memory, see MAX_UNCOMPRESSED_BYTES.
+    Raises UploadRejected when a limit is exceeded.
+    """
+    fileobj.seek(0, os.SEEK_END)
+    if fileobj.tell() > MAX_UPLOAD_BYTES:
+        raise UploadRejected(f"Upload is larger than {_mb(MAX_UPLOAD_BYTES)} MB")
+    fileobj.seek(0)
+
+    if not filename.endswith(".zip"):
+        return [(Path(filename).stem, _read_limited(fileobj, MAX_PDF_BYTES, filename))]
+
+    with zipfile.ZipFile(fileobj) as archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir() and info.filename.endswith(".pdf") and not info.filename.startswith("__MACOSX/")
+        ]
+        if len(members) > MAX_ZIP_MEMBERS:
+            raise UploadRejected(f"Zip contains more than {MAX_ZIP_MEMBERS} PDFs")
+        pdf_files = []
+        total = 0
+        for info in members:
+            # the sizes in the zip headers can lie, count what actually comes out
+            remaining = MAX_UNCOMPRESSED_BYTES - total
+            with archive.open(info) as member:
+                if remaining >= MAX_PDF_BYTES:
+                    data = _read_limited(member, MAX_PDF_BYTES, info.filename)
+                else:
+                    data = member.read(remaining + 1)
+                    if len(data) > remaining:
+                        raise UploadRejected(f"Zip expands to more than {_mb(MAX_UNCOMPRESSED_BYTES)} MB")
+            total += len(data)
+            pdf_files.append((Path(info.filename).stem, data))
+        return pdf_files
+
+def extract_cache_key(data: bytes) -> str:
+    # a new extractor version must not return text cached by an older one
+    return f"{hashlib.sha256(data).hexdigest()}:v{EXTRACTOR_VERSION}"
+
+def _page_count(data: bytes) -> int:
+    # only reads the page tree, fast enough for a thread
+    return len(PyPDF2.PdfReader(io.BytesIO(data)).pages)
+
+def _extract_pages(source, start: int, end: int) -> list[str]:
+    # source is the PDF's bytes, or the path of a copy shared by range tasks so
+    # the bytes aren't pickled to the pool once per range
+    reader = PyPDF2.PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+    return [reader.pages[number].extract_text() or "" for number in range(start, min(end, len(reader.pages)))]
+
+def _write_temp(data: bytes) -> str:
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(data)
+        return f.name
+
+async def extract_pdf(name: str, data: bytes) -> ExtractedPdf:
+    """
+    Extracts the text of every page on the process pool, large PDFs split in
+    page ranges that are extracted in parallel. Files extracted before are
+    answered from the cache by content hash.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    key = await asyncio.to_thread(extract_cache_key, data)
+    cached = await get_cached_pages(key)
+    if cached is not None:
+        return ExtractedPdf(name, cached, time.perf_counter() - started, cached=True)
+
+    pool = _get_pool()
+    page_count = await asyncio.to_thread(_page_count, data)
+    if page_count < PDF_SPLIT_MIN_PAGES or PDF_EXTRACT_WORKERS == 1:
+        # one task, splitting only pays off when workers can share a big file
+        pages = await loop.run_in_executor(pool, _extract_pages, data, 0, page_count)
+    else:
+        # every range task parses the document, so no more ranges than workers
+        per_task = max(PDF_PAGES_PER_TASK, -(-page_count // PDF_EXTRACT_WORKERS))
+        path = await asyncio.to_thread(_write_temp, data)
+        try:
+            ranges = await asyncio.gather(*(
+                loop.run_in_executor(pool, _extract_pages, path, start, start + per_task)
+                for start in range(0, page_count, per_task)
+            ))
+        finally:
+            os.remove(path)
+        # gather keeps submission order, so pages come back in document order
+        pages = [page for page_range in ranges for page in page_range]
+    await put_cached_pages(key, pages)
+    return ExtractedPdf(name, pages, time.perf_counter() - started)
+
+async def extract_pdfs(files: list[tuple[str, bytes]]) -> list[ExtractedPdf]:
+    """
+    Extracts several PDFs concurrently, results in the order of files.
+    """
+    return list(await asyncio.gather(*(extract_pdf(name, data) for name, data in files)))
+
+# marks the end of extract_into's output
+EXTRACTION_DONE = object()
+
+async def extract_into(queue: asyncio.Queue, files: list[tuple[str, bytes]]):
+    """
+    Extracts files and puts (number, ExtractedPdf) on the queue as each one
+    is done, numbered from 1 in upload order, then EXTRACTION_DONE. At most
+    PDF_EXTRACT_WORKERS files are in progress and a file waiting for room on
+    a full queue keeps its slot, so a slow consumer holds extraction back.
+    An error is put on the queue instead of raised.
+    """
+    slots = asyncio.Semaphore(PDF_EXTRACT_WORKERS)
+
+    async def extract_one(number, name, data):
+        async with slots:
+            await queue.put((number, await extract_pdf(name, data)))
+
+    try:
+        await asyncio.gather(*(extract_one(number, name, data) for number, (name, data) in enumerate(files, 1)))
+    except Exception as e:
+        await queue.put(e)
+        return
+    await queue.put(EXTRACTION_DONE)
@@ -1,39 +1,60 @@
-import PyPDF2
-import io
-from pathlib import Path
-from .grok import process_pdf_content, query_grok
+import asyncio
+import os
+
+from config import Config
+from .chunking import chunk_text
+from .pdf_extract import extract_pdf, extract_into, ExtractedPdf, EXTRACTION_DONE
+from .grok import query_grok, PRIORITY_BULK
+
+# each generated page covers at most this many tokens of the PDF, with some
+# overlap so ideas cut at a chunk boundary keep their context. Token counts
+# are chunking.estimate_tokens' estimate, the server has no model tokenizer
+PAGE_CHUNK_TOKENS = int(os.getenv("PAGE_CHUNK_TOKENS", "2500"))
+PAGE_CHUNK_OVERLAP = int(os.getenv("PAGE_CHUNK_OVERLAP", "200"))
+# LLM calls in flight at once while processing PDFs
+PDF_PROCESS_CONCURRENCY = int(os.getenv("PDF_PROCESS_CONCURRENCY", str(Config.COURSE_GENERATION_CONCURRENCY)))
+
+async def _generate_pages(pdf: ExtractedPdf, llm_slots: asyncio.Semaphore) -> list[str]:
+    async def generate(chunk):
+        async with llm_slots:
+            return await query_grok(chunk, priority=PRIORITY_BULK)
+
+    # gather keeps the chunk order
+    return list(await asyncio.gather(*(
+        generate(chunk) for chunk in chunk_text(pdf.text, PAGE_CHUNK_TOKENS, PAGE_CHUNK_OVERLAP)
+    )))
 
 async def process_pdf(filename: str, content: bytes) -> tuple[str, list[str]]:
-    # extract text from pdf
-    pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-    text_content = ""
-    
-    # combine all text
-    for page in pdf_reader.pages:
-        text_content += page.extract_text()
-    
-    # split into 3 equal parts
-    words = text_content.split()
-    total_words = len(words)
-    chunk_size = total_words // 3
-    
-    chunks = [
-        " ".join(words[i:i + chunk_size]) 
-        for i in range(0, total_words, chunk_size)
-    ][:3]  # ensure exactly 3 chunks
-    
+    # extract text from pdf, unchanged files come from the extracted text cache
+    pdf = await extract_pdf(filename, content)
     # get educational content for each chunk
-    markdown_pages = []
-    for chunk in chunks:
-        page_content = await query_grok(chunk)
-        markdown_pages.append(page_content)
-    
-    return filename, markdown_pages
+    return filename, await _generate_pages(pdf, asyncio.Semaphore(PDF_PROCESS_CONCURRENCY))
 
-async def process_pdfs(pdf_files: list[tuple[str, bytes]]) -> list[tuple[str, str]]:
-    # process each pdf and collect results
-    results = []
-    for filename, content in pdf_files:
-        result = await process_pdf(filename, content)
-        results.append(result)
-    return results 
\ No newline at end of file
+async def process_pdfs(pdf_files: list[tuple[str, bytes]], concurrency: int = PDF_PROCESS_CONCURRENCY) -> list[tuple[str, list[str]]]:
+    """
+    (filename, pages) for every PDF, in the order given. Extraction is the
+    same as course creation's (extract_into): PDFs are extracted on the
+    process pool and each one's chunks go to the LLM as soon as it is parsed,
+    at most `concurrency` calls at once across all files. Unlike
+    create_course, which writes a fixed overview/explanations/takeaways page
+    set per section, there is one page per chunk of the text.
+    """
+    llm_slots = asyncio.Semaphore(concurrency)
+    extracted = asyncio.Queue(maxsize=Config.PIPELINE_QUEUE_SIZE)
+    extraction = asyncio.create_task(extract_into(extracted, pdf_files))
+    tasks = {}  # file number -> task generating its pages
+    try:
+        while True:
+            item = await extracted.get()
+            if isinstance(item, Exception):
+                raise item
+            if item is EXTRACTION_DONE:
+                break
+            number, pdf = item
+            tasks[number] = asyncio.create_task(_generate_pages(pdf, llm_slots))
+        pages = await asyncio.gather(*(tasks[number] for number in sorted(tasks)))
+    finally:
+        extraction.cancel()
+        for task in tasks.values():
+            task.cancel()
+    return [(filename, file_pages) for (filename, _), file_pages in zip(pdf_files, pages)]
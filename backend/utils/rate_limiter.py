@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import itertools
+import random
+import re
+import time
+
+# lower number goes first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.available = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        # a request bigger than the bucket only waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0
+        return (amount - self.available) / self.refill_per_second
+
+    def take(self, amount: float):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+    def owe(self, amount: float):
+        # used more than was taken, the bucket goes negative until it refills
+        self._refill()
+        self.available -= amount
+
+    def give_back(self, amount: float):
+        self._refill()
+        self.available = min(self.capacity, self.available + amount)
+
+    def sync(self, remaining: float):
+        # the server knows better, never believe we have more than it says
+        self._refill()
+        self.available = min(self.available, remaining)
+
+class RateLimiter:
+    """
+    Client-side scheduler for calls to a rate limited API. Calls wait for
+    budget in two token buckets (requests and tokens per minute) and are let
+    through in priority order, so interactive calls overtake bulk work.
+    Budgets are corrected from the server's rate limit headers and a 429's
+    Retry-After pauses everyone, not just the call that got it.
+
+    A call reserves its prompt plus the completion length calls have been
+    using lately rather than its max_tokens, and settles the reservation
+    against the reported usage afterwards (or refunds it when it fails).
+    """
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, expected_completion_tokens: int = 1024):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.expected_completion_tokens = expected_completion_tokens
+        self._blocked_until = 0
+        self._waiters = []  # heap of [priority, seq]
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def acquire(self, estimated_tokens: int, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """
+        Waits until the call may be sent and returns how long that took.
+        """
+        started = time.monotonic()
+        entry = [priority, next(self._seq)]
+        heapq.heappush(self._waiters, entry)
+        try:
+            while True:
+                timeout = None
+                if self._waiters[0] is entry:
+                    timeout = max(
+                        self._blocked_until - time.monotonic(),
+                        self.requests.wait_time(1),
+                        self.tokens.wait_time(estimated_tokens)
+                    )
+                    if timeout <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(estimated_tokens)
+                        return time.monotonic() - started
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            # next in line may be able to go now
+            self._notify()
+
+    def reservation(self, prompt_tokens: int, max_tokens: int) -> int:
+        """
+        Tokens to reserve for a call, never more than the bucket holds.
+        """
+        expected = prompt_tokens + min(max_tokens, round(self.expected_completion_tokens))
+        return min(expected, int(self.tokens.capacity))
+
+    def settle(self, reserved: int, used_tokens: int, completion_tokens: int = None):
+        if used_tokens < reserved:
+            self.tokens.give_back(reserved - used_tokens)
+        elif used_tokens > reserved:
+            self.tokens.owe(used_tokens - reserved)
+        if completion_tokens is not None:
+            # moving average, so reservations follow what calls really use
+            self.expected_completion_tokens = 0.8 * self.expected_completion_tokens + 0.2 * completion_tokens
+        self._notify()
+
+    def refund(self, reserved: int):
+        # a failed attempt used no tokens, the retry reserves its own
+        self.tokens.give_back(reserved)
+        self._notify()
+
+    def update_from_headers(self, headers):
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_requests is not None:
+            self.requests.sync(float(remaining_requests))
+            if float(remaining_requests) <= 0:
+                self.pause(parse_duration(headers.get("x-ratelimit-reset-requests")))
+        if remaining_tokens is not None:
+            self.tokens.sync(float(remaining_tokens))
+            if float(remaining_tokens) <= 0:
+                self.pause(parse_duration(headers.get("x-ratelimit-reset-tokens")))
+
+    def pause(self, seconds: float):
+        if seconds:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def status(self):
+        return {
+            "waiting": len(self._waiters),
+            "requests_available": round(self.requests.available, 1),
+            "tokens_available": round(self.tokens.available),
+            "expected_completion_tokens": round(self.expected_completion_tokens),
+            "paused_for": max(0, round(self._blocked_until - time.monotonic(), 1)),
+        }
+
+def parse_duration(value) -> float:
+    """
+    Parses Retry-After / reset headers: plain seconds ("7") or Go style
+    durations ("2m59.56s", "120ms").
+    """
+    if not value:
+        return 0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(amount) * units[unit] for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value))
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    # exponential backoff with jitter so retries from parallel calls spread out
+    return random.uniform(0.5, 1.0) * min(cap, base * 2 ** attempt)
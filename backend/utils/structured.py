@@ -0,0 +1,130 @@
+import json
+import re
+from typing import Annotated, Literal
+
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator, model_validator
+
+class QuizQuestionSchema(BaseModel):
+    question: str = Field(min_length=1)
+    options: list[str] = Field(min_length=4, max_length=4)
+    correctAnswer: int = Field(ge=0, le=3)
+
+    @model_validator(mode="before")
+    @classmethod
+    def keep_four_options(cls, data):
+        # models sometimes add a fifth option, keep the correct one when cutting
+        if isinstance(data, dict) and isinstance(data.get("options"), list) and len(data["options"]) > 4:
+            options = list(data["options"])
+            answer = data.get("correctAnswer")
+            if isinstance(answer, int) and 0 <= answer < len(options):
+                correct = options[answer]
+                options = options[:4]
+                if correct not in options:
+                    options[-1] = correct
+                data = {**data, "options": options, "correctAnswer": options.index(correct)}
+        return data
+
+class CourseDetailsSchema(BaseModel):
+    description: str = Field(min_length=1)
+    difficulty: Literal["Beginner", "Intermediate", "Advanced"]
+    estimated_hours: int = Field(gt=0)
+    learning_outcomes: list[str] = Field(min_length=1)
+    prerequisites: list[str] = []
+    skills_gained: list[str] = []
+    course_highlights: list[str] = []
+
+    @field_validator("difficulty", mode="before")
+    @classmethod
+    def capitalize_difficulty(cls, value):
+        return value.strip().capitalize() if isinstance(value, str) else value
+
+# exactly 4 questions, extra ones are dropped before validating
+QUIZ_SCHEMA = TypeAdapter(Annotated[list[QuizQuestionSchema], Field(min_length=4, max_length=4)])
+COURSE_DETAILS_SCHEMA = TypeAdapter(CourseDetailsSchema)
+
+class StructuredOutputError(Exception):
+    def __init__(self, message: str, fragment: str):
+        super().__init__(message)
+        self.fragment = fragment
+
+def _lenient(text: str) -> str:
+    # comments and trailing commas are the usual reasons a reply isn't JSON
+    text = re.sub(r"\s*//.*$", "", text, flags=re.MULTILINE)
+    return re.sub(r",\s*([}\]])", r"\1", text)
+
+def _json_values(text: str):
+    # JSON values that decode at a [ or {, in order of position, leaving out
+    # those nested in a value already found
+    decoder = json.JSONDecoder()
+    end = 0
+    for match in re.finditer(r"[\[{]", text):
+        if match.start() < end:
+            continue
+        for candidate in (text[match.start():], _lenient(text[match.start():])):
+            try:
+                value, length = decoder.raw_decode(candidate)
+            except json.JSONDecodeError:
+                continue
+            # the lenient copy is shorter, so its length never overshoots
+            end = match.start() + length
+            yield value
+            break
+
+def _from_first_bracket(text: str) -> str:
+    start = re.search(r"[\[{]", text)
+    return text[start.start():] if start else text
+
+def _top_level_type(schema: TypeAdapter):
+    return {"array": list, "object": dict}.get(schema.json_schema().get("type"))
+
+def extract_json(text: str, expected_type: type = None):
+    """
+    First JSON object or array in text (of expected_type when given),
+    skipping any prose or code fences around it. Raises StructuredOutputError
+    when there is none.
+    """
+    for value in _json_values(text):
+        if expected_type is None or isinstance(value, expected_type):
+            return value
+    raise StructuredOutputError("no valid JSON found", _from_first_bracket(text))
+
+def parse_structured(text: str, schema: TypeAdapter, max_items: int = None):
+    """
+    Validates the JSON values in text against the schema and returns the
+    first that passes as plain dicts/lists, so a "[4]" in the prose or a
+    question of a truncated quiz isn't taken for the reply. max_items cuts a
+    list reply down before validating. On failure the error is the first
+    value of the right type's and the fragment is the raw reply from its
+    first bracket on.
+    """
+    expected_type = _top_level_type(schema)
+    first_error = None
+    for value in _json_values(text):
+        if expected_type is not None and not isinstance(value, expected_type):
+            continue
+        if max_items is not None and isinstance(value, list):
+            value = value[:max_items]
+        try:
+            return schema.dump_python(schema.validate_python(value))
+        except ValidationError as e:
+            first_error = first_error or "; ".join(
+                f"{'.'.join(str(part) for part in error['loc']) or 'value'}: {error['msg']}" for error in e.errors()
+            )
+    kind = {list: "array", dict: "object"}.get(expected_type, "value")
+    raise StructuredOutputError(first_error or f"no valid JSON {kind} found", _from_first_bracket(text))
+
+def repair_messages(fragment: str, error: str, schema: TypeAdapter) -> list[dict]:
+    """
+    A short prompt that fixes only the broken reply, much cheaper than
+    sending the original prompt again.
+    """
+    return [
+        {
+            "role": "system",
+            "content": "You fix JSON so it matches a JSON schema. Reply with the corrected JSON only, no other text."
+        },
+        {
+            "role": "user",
+            "content": f"Schema:\n{json.dumps(schema.json_schema(), separators=(',', ':'))}\n\nProblem: {error}\n\nJSON to fix:\n{fragment}"
+        }
+    ]
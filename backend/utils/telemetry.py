@@ -0,0 +1,114 @@
+import asyncio
+import contextvars
+import json
+import os
+
+from sqlalchemy import case, func, or_
+
+from database import SessionLocal
+from models import Course, LLMCall
+
+# who a call is made for, set by the handlers and inherited by the tasks they start
+current_course_id = contextvars.ContextVar("current_course_id", default=None)
+current_user_id = contextvars.ContextVar("current_user_id", default=None)
+
+# USD per million prompt and completion tokens, unknown models (and the local
+# one) cost nothing. Override with LLM_PRICES='{"model": [prompt, completion]}'
+MODEL_PRICES = {
+    "llama3-groq-8b-8192-tool-use-preview": (0.19, 0.19),
+    "llama3-groq-70b-8192-tool-use-preview": (0.89, 0.89),
+}
+MODEL_PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv("LLM_PRICES", "{}")).items()})
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0, 0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def _write(fields: dict):
+    db = SessionLocal()
+    try:
+        db.add(LLMCall(**fields))
+        db.commit()
+    finally:
+        db.close()
+
+async def record_llm_call(provider: str, model: str, kind: str, outcome: str, prompt_tokens: int = 0, completion_tokens: int = 0, queue_wait: float = None, time_to_first_token: float = None, latency: float = None, attempts: int = 1, error: str = None):
+    fields = {
+        "provider": provider,
+        "model": model,
+        "kind": kind,
+        "course_id": current_course_id.get(),
+        "user_id": current_user_id.get(),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "queue_wait": queue_wait,
+        "time_to_first_token": time_to_first_token,
+        "latency": latency,
+        "attempts": attempts,
+        "outcome": outcome,
+        "error": error,
+        # cache hits were paid for by the call that stored them
+        "cost": 0 if outcome == "cached" else call_cost(model, prompt_tokens, completion_tokens),
+    }
+    try:
+        await asyncio.to_thread(_write, fields)
+    except Exception as e:
+        # losing a metrics row must never fail the call itself
+        print(f"Failed to record LLM call: {e}")
+
+def _aggregate(query, *group_by):
+    columns = [
+        func.count(LLMCall.id),
+        func.sum(case((LLMCall.outcome == "error", 1), else_=0)),
+        func.sum(case((LLMCall.outcome == "cached", 1), else_=0)),
+        func.coalesce(func.sum(LLMCall.prompt_tokens), 0),
+        func.coalesce(func.sum(LLMCall.completion_tokens), 0),
+        func.avg(LLMCall.queue_wait),
+        func.avg(LLMCall.time_to_first_token),
+        func.avg(LLMCall.latency),
+        func.max(LLMCall.latency),
+        func.coalesce(func.sum(LLMCall.cost), 0),
+    ]
+    rows = query.with_entities(*group_by, *columns).group_by(*group_by).all()
+    result = []
+    for row in rows:
+        keys, values = row[:len(group_by)], row[len(group_by):]
+        calls, errors, cached, prompt_tokens, completion_tokens, queue_wait, ttft, latency, max_latency, cost = values
+        result.append({
+            **{column.key: key for column, key in zip(group_by, keys)},
+            "calls": calls,
+            "errors": errors or 0,
+            "cached": cached or 0,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "avg_queue_wait": round(queue_wait, 3) if queue_wait is not None else None,
+            "avg_time_to_first_token": round(ttft, 3) if ttft is not None else None,
+            "avg_latency": round(latency, 3) if latency is not None else None,
+            "max_latency": round(max_latency, 3) if max_latency is not None else None,
+            "cost": round(cost, 6),
+        })
+    return result
+
+def llm_metrics(db, since=None, course_id=None, user_id=None, professor_id=None) -> dict:
+    """
+    Call counts, tokens, latencies and cost per model, per course and per
+    user, optionally only since a datetime or for one course or user.
+    professor_id limits it to that professor's own calls and calls for
+    their courses.
+    """
+    query = db.query(LLMCall)
+    if professor_id is not None:
+        owned = db.query(Course.id).filter(Course.professor_id == professor_id)
+        query = query.filter(or_(LLMCall.user_id == professor_id, LLMCall.course_id.in_(owned)))
+    if since is not None:
+        query = query.filter(LLMCall.created_at >= since)
+    if course_id is not None:
+        query = query.filter(LLMCall.course_id == course_id)
+    if user_id is not None:
+        query = query.filter(LLMCall.user_id == user_id)
+    return {
+        "by_model": _aggregate(query, LLMCall.provider, LLMCall.model),
+        "by_kind": _aggregate(query, LLMCall.provider, LLMCall.kind),
+        "by_course": _aggregate(query.filter(LLMCall.course_id.isnot(None)), LLMCall.course_id),
+        "by_user": _aggregate(query.filter(LLMCall.user_id.isnot(None)), LLMCall.user_id),
+    }
@@ -198,7 +198,7 @@ export default function CourseView() {
                             text-white rounded-xl shadow-md hover:shadow-lg transition-all
                             flex items-center justify-center group"
                     >
-                        Take Final Quiz
+                        Take Section Quiz
                         <FiArrowRight className="ml-2 group-hover:translate-x-1 transition-transform" />
                     </motion.button>
                 </motion.div>
@@ -162,6 +162,16 @@ export default function GenerationProgress({ progress, courseId }) {
                                 />
                             </div>
                         )}
+                        {cat.stats?.liveWordCount !== undefined && (
+                            <p className="text-xs text-gray-500 text-center">
+                                {cat.stats.liveWordCount} words, {cat.stats.liveTokenCount} tokens written so far
+                            </p>
+                        )}
+                        {cat.stats?.preview && (
+                            <p className="text-xs text-gray-400 italic text-center line-clamp-2">
+                                …{cat.stats.preview}
+                            </p>
+                        )}
                         {getEmojis(cat.stats?.pageCount || 0, cat.stats?.totalPages || 24)}
                     </div>
                 )
@@ -173,7 +183,7 @@ export default function GenerationProgress({ progress, courseId }) {
                         )}
                         {cat.status === 'completed' ? 
                             getEmojis(1, 1) : 
-                            getEmojis(cat.stats?.questionCount || 0, 4)}
+                            getEmojis(cat.stats?.sectionCount || 0, cat.stats?.totalSections || 4)}
                     </div>
                 )
             default:
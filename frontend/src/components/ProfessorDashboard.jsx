@@ -85,13 +85,16 @@ export default function ProfessorDashboard() {
 
             const reader = response.body.getReader()
             const decoder = new TextDecoder()
+            // events can be split across reads, keep the unfinished last line
+            let buffer = ''
 
             while (true) {
                 const { value, done } = await reader.read()
                 if (done) break
 
-                const chunk = decoder.decode(value)
-                const lines = chunk.split('\n')
+                buffer += decoder.decode(value, { stream: true })
+                const lines = buffer.split('\n')
+                buffer = lines.pop()
 
                 for (const line of lines) {
                     if (line.startsWith('data: ')) {